@@ -0,0 +1,70 @@
+'''imports'''
+import sys
+import os
+import glob
+import time
+
+import numpy as np
+
+'''personal imports'''
+sys.path.append(os.path.abspath("image_processing"))
+from image_processing.image import readImage
+from image_processing.edge_detection import blueFilter, yellowFilter, orangeFilter, morphOpen, getContours, contourIsCone, detectCones
+from rpi3Bplus.classes.utils_onnx import match_detections
+
+# compares detectCones (one HSV conversion, connected components) with the filters of
+# image_process_test.py (one filter, Canny and findContours per color) on the test images
+paths = sorted(glob.glob("testimages/*-small.jpg"))
+iou_match = 0.5
+
+'''functions'''
+def filterCones(img):
+    # old pipeline, colors in the order of the class ids
+    boxes = []
+    class_ids = []
+    for class_id, colorFilter in enumerate([yellowFilter, blueFilter, orangeFilter]):
+        for contour in getContours(morphOpen(colorFilter(img))):
+            isCone, [x, y, w, h] = contourIsCone(contour)
+            if isCone:
+                boxes.append([x, y, x + w, y + h])
+                class_ids.append(class_id)
+    boxes = np.array(boxes, dtype=np.float32).reshape(-1, 4)
+    return boxes, np.ones(len(boxes), dtype=np.float32), np.array(class_ids, dtype=int)
+
+def run(function, images):
+    times = []
+    results = []
+    for img in images:
+        t0 = time.perf_counter()
+        results.append(function(img))
+        times.append(time.perf_counter() - t0)
+    return float(np.median(times)), results
+
+def detect(img):
+    boxes, class_ids = detectCones(img)
+    return boxes, np.ones(len(boxes), dtype=np.float32), class_ids
+
+'''main'''
+images = [readImage(path) for path in paths]
+filter_time, filter_results = run(filterCones, images)
+detect_time, detect_results = run(detect, images)
+
+matched = 0
+filter_count = 0
+detect_count = 0
+ious = []
+for path, filter_result, detect_result in zip(paths, filter_results, detect_results):
+    frame_matched, frame_filter, frame_detect, frame_ious = match_detections(filter_result, detect_result, iou_match)
+    print(f"{path}: {frame_filter} cones with the filters, {frame_detect} with detectCones, {frame_matched} the same")
+    matched += frame_matched
+    filter_count += frame_filter
+    detect_count += frame_detect
+    ious += frame_ious
+
+print(f"Pipeline\tLatency (median)\tCones")
+print(f"Filters\t\t{filter_time*1000:.2f} ms\t\t{filter_count}")
+print(f"detectCones\t{detect_time*1000:.2f} ms\t\t{detect_count}")
+if filter_count + detect_count > 0:
+    print(f"Agreement (F1): {2*matched/(filter_count + detect_count)*100:.1f} %")
+if len(ious) > 0:
+    print(f"Mean IoU of matched cones: {np.mean(ious):.3f}")
@@ -0,0 +1,158 @@
+'''imports'''
+import glob
+import time
+
+import cv2
+import numpy as np
+import onnx
+from onnx import helper, numpy_helper, TensorProto
+
+'''personal imports'''
+from rpi3Bplus.classes.yolo_onnx import Yolo, quantized_model_path, end_to_end_model_path
+
+# makes an end-to-end copy of the YOLO model: input is the uint8 BGR frame (1, height, width, 3)
+# of any size, outputs are the boxes (xyxy in frame pixels), scores and class ids after
+# class aware nms. Conversion, resizing, scaling and nms all run inside onnxruntime
+onnx_path = "rpi3Bplus/data/YOLOv8n_FSOCO.onnx"
+quantized = False # export the INT8 model of quantize_yolo.py instead
+image_paths = sorted(glob.glob("testimages/*-small.jpg"))
+
+'''functions'''
+def constant(graph, name, array):
+    graph.initializer.append(numpy_helper.from_array(np.asarray(array), name))
+    return name
+
+def preprocessing_nodes(graph, frame_name, images_name, input_height, input_width):
+    # uint8 NHWC BGR -> float32 NCHW RGB at the input size of the network, scaled to 0 to 1
+    return [
+        helper.make_node("Cast", [frame_name], ["e2e_frame_float"], to=TensorProto.FLOAT),
+        helper.make_node("Transpose", ["e2e_frame_float"], ["e2e_frame_bgr"], perm=[0, 3, 1, 2]),
+        helper.make_node("Gather", ["e2e_frame_bgr", constant(graph, "e2e_rgb_order", np.array([2, 1, 0], dtype=np.int64))],
+                         ["e2e_frame_rgb"], axis=1),
+        # roi and scales have to be given as empty tensors when sizes is used
+        helper.make_node("Resize", ["e2e_frame_rgb", constant(graph, "e2e_roi", np.zeros(0, dtype=np.float32)),
+                                    constant(graph, "e2e_scales", np.zeros(0, dtype=np.float32)),
+                                    constant(graph, "e2e_input_size", np.array([1, 3, input_height, input_width], dtype=np.int64))],
+                         ["e2e_frame_resized"], mode="linear"),
+        helper.make_node("Mul", ["e2e_frame_resized", constant(graph, "e2e_pixel_scale", np.array(1 / 255.0, dtype=np.float32))],
+                         [images_name]),
+    ]
+
+def postprocessing_nodes(graph, frame_name, output_name, input_height, input_width):
+    # output (1, 4 + classes, anchors) with boxes as center x, center y, width, height
+    nodes = [
+        # boxes (1, anchors, 4) and class scores (1, classes, anchors)
+        helper.make_node("Slice", [output_name, constant(graph, "e2e_zero", np.array([0], dtype=np.int64)),
+                                   constant(graph, "e2e_four", np.array([4], dtype=np.int64)),
+                                   constant(graph, "e2e_axis_one", np.array([1], dtype=np.int64))],
+                         ["e2e_boxes_cxcywh_t"]),
+        helper.make_node("Transpose", ["e2e_boxes_cxcywh_t"], ["e2e_boxes_cxcywh"], perm=[0, 2, 1]),
+        helper.make_node("Slice", [output_name, "e2e_four", constant(graph, "e2e_end", np.array([np.iinfo(np.int64).max], dtype=np.int64)),
+                                   "e2e_axis_one"],
+                         ["e2e_class_scores"]),
+
+        # only the best class of every anchor takes part in the nms, like in process_output
+        helper.make_node("ArgMax", ["e2e_class_scores"], ["e2e_best_class"], axis=1, keepdims=1),
+        helper.make_node("GatherElements", ["e2e_class_scores", "e2e_best_class"], ["e2e_best_score"], axis=1),
+        helper.make_node("Equal", ["e2e_class_scores", "e2e_best_score"], ["e2e_is_best"]),
+        helper.make_node("Cast", ["e2e_is_best"], ["e2e_is_best_float"], to=TensorProto.FLOAT),
+        helper.make_node("Mul", ["e2e_class_scores", "e2e_is_best_float"], ["e2e_scores"]),
+
+        # class aware nms, selected is (detections, 3) with (batch, class, anchor),
+        # max_detections is per class here
+        helper.make_node("NonMaxSuppression", ["e2e_boxes_cxcywh", "e2e_scores", "max_detections", "iou_threshold", "score_threshold"],
+                         ["e2e_selected"], center_point_box=1),
+        helper.make_node("Gather", ["e2e_selected", constant(graph, "e2e_class_column", np.array(1, dtype=np.int64))],
+                         ["class_ids"], axis=1),
+        helper.make_node("Gather", ["e2e_selected", constant(graph, "e2e_anchor_column", np.array(2, dtype=np.int64))],
+                         ["e2e_anchors"], axis=1),
+        helper.make_node("GatherND", ["e2e_scores", "e2e_selected"], ["scores"]),
+
+        # selected boxes to xyxy
+        helper.make_node("Gather", ["e2e_boxes_cxcywh", "e2e_anchors"], ["e2e_selected_cxcywh"], axis=1),
+        helper.make_node("Reshape", ["e2e_selected_cxcywh", constant(graph, "e2e_box_shape", np.array([-1, 4], dtype=np.int64))],
+                         ["e2e_selected_boxes"]),
+        helper.make_node("Slice", ["e2e_selected_boxes", "e2e_zero", constant(graph, "e2e_two", np.array([2], dtype=np.int64)), "e2e_axis_one"],
+                         ["e2e_center"]),
+        helper.make_node("Slice", ["e2e_selected_boxes", "e2e_two", "e2e_four", "e2e_axis_one"], ["e2e_size"]),
+        helper.make_node("Mul", ["e2e_size", constant(graph, "e2e_half", np.array(0.5, dtype=np.float32))], ["e2e_half_size"]),
+        helper.make_node("Sub", ["e2e_center", "e2e_half_size"], ["e2e_top_left"]),
+        helper.make_node("Add", ["e2e_center", "e2e_half_size"], ["e2e_bottom_right"]),
+        helper.make_node("Concat", ["e2e_top_left", "e2e_bottom_right"], ["e2e_boxes_input"], axis=1),
+
+        # rescale from the network input size to the size of the frame
+        helper.make_node("Shape", [frame_name], ["e2e_frame_shape"]),
+        helper.make_node("Gather", ["e2e_frame_shape", constant(graph, "e2e_width_height", np.array([2, 1, 2, 1], dtype=np.int64))],
+                         ["e2e_frame_size"]),
+        helper.make_node("Cast", ["e2e_frame_size"], ["e2e_frame_size_float"], to=TensorProto.FLOAT),
+        helper.make_node("Div", ["e2e_frame_size_float",
+                                 constant(graph, "e2e_network_size", np.array([input_width, input_height, input_width, input_height], dtype=np.float32))],
+                         ["e2e_box_scale"]),
+        helper.make_node("Mul", ["e2e_boxes_input", "e2e_box_scale"], ["boxes"]),
+    ]
+    return nodes
+
+def export_end_to_end(path_of_model, path_of_export):
+    model = onnx.load(path_of_model)
+    graph = model.graph
+    opset = max(entry.version for entry in model.opset_import if entry.domain in ("", "ai.onnx"))
+    if opset < 11:
+        raise RuntimeError(f"Model has opset {opset}, at least 11 is needed for Resize with sizes and GatherND")
+
+    images = graph.input[0]
+    output_name = graph.output[0].name
+    input_height, input_width = [dim.dim_value for dim in images.type.tensor_type.shape.dim[2:]]
+
+    frame_name = "frame"
+    frame = helper.make_tensor_value_info(frame_name, TensorProto.UINT8, [1, "height", "width", 3])
+    thresholds = [helper.make_tensor_value_info("score_threshold", TensorProto.FLOAT, [1]),
+                  helper.make_tensor_value_info("iou_threshold", TensorProto.FLOAT, [1]),
+                  helper.make_tensor_value_info("max_detections", TensorProto.INT64, [1])]
+
+    nodes = preprocessing_nodes(graph, frame_name, images.name, input_height, input_width)
+    nodes += list(graph.node)
+    nodes += postprocessing_nodes(graph, frame_name, output_name, input_height, input_width)
+    del graph.node[:]
+    graph.node.extend(nodes)
+
+    graph.input.remove(images)
+    graph.input.extend([frame] + thresholds)
+    del graph.output[:]
+    graph.output.extend([helper.make_tensor_value_info("boxes", TensorProto.FLOAT, ["detections", 4]),
+                         helper.make_tensor_value_info("scores", TensorProto.FLOAT, ["detections"]),
+                         helper.make_tensor_value_info("class_ids", TensorProto.INT64, ["detections"])])
+    # Yolo reads the size the network runs at from here
+    helper.set_model_props(model, {"input_size": f"{input_height},{input_width}"})
+
+    onnx.checker.check_model(model)
+    onnx.save(model, path_of_export)
+
+def run_model(model, frames):
+    times = []
+    results = []
+    for frame in frames:
+        t0 = time.perf_counter()
+        results.append(model.feed_forward(frame))
+        times.append(time.perf_counter() - t0)
+    return float(np.median(times)), results
+
+'''main'''
+if quantized:
+    onnx_path = quantized_model_path(onnx_path)
+export_path = end_to_end_model_path(onnx_path)
+export_end_to_end(onnx_path, export_path)
+print(f"End-to-end model written to {export_path}")
+
+# same frames through both models, the numbers of cones should match
+frames = [cv2.imread(path) for path in image_paths]
+python_model = Yolo(onnx_path)
+end_to_end_model = Yolo(onnx_path, end_to_end=True)
+python_time, python_results = run_model(python_model, frames)
+end_to_end_time, end_to_end_results = run_model(end_to_end_model, frames)
+
+print(f"Model\t\tLatency (median)\tCones")
+print(f"Python pre/post\t{python_time*1000:.2f} ms\t{sum(len(result[1]) for result in python_results)}")
+print(f"End-to-end\t{end_to_end_time*1000:.2f} ms\t{sum(len(result[1]) for result in end_to_end_results)}")
+for path, python_result, end_to_end_result in zip(image_paths, python_results, end_to_end_results):
+    if len(python_result[1]) != len(end_to_end_result[1]):
+        print(f"{path}: {len(python_result[1])} cones with python post-processing, {len(end_to_end_result[1])} end-to-end")
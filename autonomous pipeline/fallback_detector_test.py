@@ -0,0 +1,29 @@
+'''imports'''
+import sys
+import os
+import glob
+import numpy as np
+
+'''personal imports'''
+sys.path.append(os.path.abspath("image_processing"))
+from image_processing.image import readImage
+from image_processing.edge_detection import HsvConeDetector, classMask, lutClassMask, loadColorLut
+from rpi3Bplus.classes.yolo_onnx import Yolo, compare_detectors
+
+onnx_path = "rpi3Bplus/data/YOLOv8n_FSOCO.onnx"
+paths = sorted(glob.glob("testimages/*-small.jpg"))
+
+images = [readImage(path) for path in paths]
+print(f"{len(images)} images")
+
+# lookup table against the HSV conversion, on the pixels either of them gives a cone color
+lut = loadColorLut()
+for path, image in zip(paths, images):
+    class_mask = classMask(image)
+    lut_mask = lutClassMask(image, lut)
+    colored = (class_mask > 0) | (lut_mask > 0)
+    agreement = np.mean(class_mask[colored] == lut_mask[colored]) if np.any(colored) else 1.0
+    print(f"{os.path.basename(path)}\tlookup table agrees on {agreement*100:.1f}% of the colored pixels")
+
+# YOLO is the reference, agreement = how many of its cones the HSV detector finds as well
+compare_detectors({"YOLO": Yolo(onnx_path), "HSV": HsvConeDetector(), "HSV LUT": HsvConeDetector(use_lut=True)}, images)
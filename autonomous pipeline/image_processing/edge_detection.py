@@ -2,11 +2,14 @@
 #https://gist.github.com/razimgit/d9c91edfd1be6420f58a74e1837bde18
 
 '''imports'''
+import os
 import numpy as np
 import cv2 #pip install opencv-python
+from concurrent.futures import ThreadPoolExecutor
 
 '''personal imports'''
 import image
+from classes.utils_onnx import bottom_centerpoints
 
 '''constants'''
 #blue treshold in HSV
@@ -18,6 +21,23 @@ tresh_yellow_upper = np.array([60,255,255])
 #orange treshold in HSV
 tresh_orange_lower = np.array([0,35,140])
 tresh_orange_upper = np.array([15,255,255])
+#colors in the order of the class ids of utils_onnx (yellow_cone, blue_cone, orange_cone),
+#label in the class mask = class id + 1, 0 = background
+cone_colors = [(tresh_yellow_lower, tresh_yellow_upper),
+               (tresh_blue_lower, tresh_blue_upper),
+               (tresh_orange_lower, tresh_orange_upper)]
+#smallest cone height in pixels (as in contourIsCone)
+min_cone_height = 12
+#opencv releases the GIL, the colors are processed in parallel threads
+executor = ThreadPoolExecutor(max_workers=len(cone_colors))
+#BGR -> class lookup table, 2^lut_bits levels per channel (at most 8), cached next to this file,
+#8 bits gives the same classes as classMask, fewer bits merge colors on the border of a threshold
+lut_bits = 8
+lut_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cone_color_lut.npz")
+#split computing: the box of a proposal is enlarged by crop_padding (fraction) and made square,
+#at least min_crop_size pixels
+crop_padding = 0.5
+min_crop_size = 32
 
 '''code'''
 def blueFilter(img):
@@ -115,4 +135,197 @@ def contourIsCone(contour):
             return False, [x, y, w, h]
     
     #return True and bounding box if cone/pointing up
-    return True, [x, y, w, h]
\ No newline at end of file
+    return True, [x, y, w, h]
+
+def classMask(img):
+    #one HSV conversion for all colors, labeled mask with class id + 1 per pixel
+    hsv_img = image.Rgb2HsvImage(img)
+    class_mask = np.zeros(img.shape[:2], dtype=np.uint8)
+    for class_id, (lower, upper) in enumerate(cone_colors):
+        #pixels in two ranges (yellow and orange share hue 15) keep the first color
+        mask = cv2.inRange(hsv_img, lower, upper)
+        mask[class_mask > 0] = 0
+        class_mask[mask > 0] = class_id + 1
+    return class_mask
+
+def buildColorLut(bits=lut_bits):
+    #every BGR color through the same conversion and thresholds as classMask, a cell of the
+    #table gets the class most of its colors have
+    if not 1 <= bits <= 8:
+        raise ValueError("lut_bits has to be 1 to 8, not {}".format(bits))
+    levels = 1 << bits
+    step = 256 // levels
+    values = np.arange(256, dtype=np.uint8)
+    b, g, r = np.meshgrid(values, values, values, indexing="ij")
+    colors = np.stack([b, g, r], axis=-1).reshape(4096, 4096, 3)
+    classes = classMask(colors).reshape(levels, step, levels, step, levels, step)
+    counts = [np.count_nonzero(classes == label, axis=(1, 3, 5)) for label in range(len(cone_colors) + 1)]
+    return np.argmax(counts, axis=0).astype(np.uint8)
+
+def loadColorLut(bits=lut_bits, path=lut_path):
+    #built once, rebuilt when the thresholds change
+    key = np.concatenate([np.concatenate(color) for color in cone_colors] + [[bits]])
+    if os.path.exists(path):
+        cached = np.load(path)
+        if np.array_equal(cached["key"], key):
+            return cached["lut"]
+    lut = buildColorLut(bits)
+    try:
+        np.savez_compressed(path, lut=lut, key=key)
+    except OSError:
+        print("Could not cache the color lookup table in {}".format(path))
+    return lut
+
+def lutClassMask(img, lut):
+    #same labeled mask as classMask with one table lookup per pixel instead of a HSV
+    #conversion and an inRange per color
+    levels = lut.shape[0]
+    bits = levels.bit_length() - 1
+    if lut.shape != (levels, levels, levels) or levels != 1 << bits or bits > 8:
+        raise ValueError("lookup table of shape {} can not be indexed by 8 bit colors".format(lut.shape))
+    shift = 8 - bits
+    #3*bits wide index, more than 16 bits from 6 bits on
+    quantized = np.right_shift(img, shift).astype(np.uint32)
+    index = (quantized[:, :, 0] << (2*bits)) | (quantized[:, :, 1] << bits) | quantized[:, :, 2]
+    return np.take(lut.reshape(-1), index)
+
+def colorComponents(class_mask, class_id):
+    #connected regions of one color after removing noise, returns their stats (x, y, w, h, area)
+    #and the component label of every pixel
+    mask = morphOpen((class_mask == class_id + 1).view(np.uint8))
+    count, labels, stats, centroids = cv2.connectedComponentsWithStats(mask, connectivity=8)
+    return stats[1:], labels
+
+def componentsAreCones(stats, labels):
+    #vectorized contourIsCone for all components of one color: the upper two thirds of a
+    #cone lie within the left and right bound of its lower third
+    count = len(stats)
+    tall = stats[:, cv2.CC_STAT_HEIGHT] >= min_cone_height
+    if not np.any(tall):
+        return tall
+    ys, xs = np.nonzero(labels)
+    components = labels[ys, xs] - 1
+    #only the pixels of components high enough for a cone
+    keep = tall[components]
+    ys, xs, components = ys[keep], xs[keep], components[keep]
+    top = stats[components, cv2.CC_STAT_TOP]
+    height = stats[components, cv2.CC_STAT_HEIGHT]
+    upper = ys < top + 2*height/3
+
+    lower_left = np.full(count, np.iinfo(np.int32).max)
+    lower_right = np.full(count, -1)
+    np.minimum.at(lower_left, components[~upper], xs[~upper])
+    np.maximum.at(lower_right, components[~upper], xs[~upper])
+    upper_left = np.full(count, np.iinfo(np.int32).max)
+    upper_right = np.full(count, -1)
+    np.minimum.at(upper_left, components[upper], xs[upper])
+    np.maximum.at(upper_right, components[upper], xs[upper])
+
+    #components without upper points pass, as in contourIsCone
+    has_upper = upper_right >= 0
+    within = (upper_left >= lower_left) & (upper_right <= lower_right)
+    return tall & (~has_upper | within)
+
+def colorCones(class_mask, class_id):
+    #boxes (x, y, w, h) of the components of one color shaped like a cone
+    stats, labels = colorComponents(class_mask, class_id)
+    return stats[componentsAreCones(stats, labels), :4]
+
+def colorProposals(class_mask, class_id):
+    #every region of one color high enough for a cone, without the shape test (the computer
+    #classifies the crops, a cone split in two by its stripe should not be lost)
+    stats, labels = colorComponents(class_mask, class_id)
+    return stats[stats[:, cv2.CC_STAT_HEIGHT] >= min_cone_height]
+
+def proposalCrops(stats, frame_size, padding=crop_padding, min_size=min_crop_size):
+    #square crops (x0, y0, x1, y1) around the regions, moved inside the frame
+    height, width = frame_size
+    sizes = np.maximum(stats[:, 2:4].max(axis=1) * (1 + padding), min_size)
+    sizes = np.minimum(sizes, min(height, width)).astype(int)
+    centers = stats[:, :2] + stats[:, 2:4] / 2
+    x0 = np.clip((centers[:, 0] - sizes/2).astype(int), 0, width - sizes)
+    y0 = np.clip((centers[:, 1] - sizes/2).astype(int), 0, height - sizes)
+    return np.stack([x0, y0, x0 + sizes, y0 + sizes], axis=1)
+
+def detectCones(img, parallel=True, class_mask=None):
+    #single pass for all colors instead of the filters, getContours and contourIsCone above:
+    #connected components of the class mask instead of Canny contours, so the cones found
+    #differ (edge_detection_test.py), returns boxes (x0, y0, x1, y1) and class ids
+    if class_mask is None:
+        class_mask = classMask(img)
+    class_ids = range(len(cone_colors))
+    if parallel:
+        cones = list(executor.map(lambda class_id: colorCones(class_mask, class_id), class_ids))
+    else:
+        cones = [colorCones(class_mask, class_id) for class_id in class_ids]
+
+    boxes = np.concatenate(cones).astype(np.float32)
+    boxes[:, 2:] += boxes[:, :2]
+    return boxes, np.repeat(np.arange(len(cones)), [len(color_cones) for color_cones in cones])
+
+class HsvConeDetector():
+    # the cone detection above as a detector with the same (boxes, scores,
+    # class_ids) output as Yolo.feed_forward, fallback when YOLO is too slow or the link drops
+    def __init__(self, output_size=None, parallel=True, use_lut=False):
+        self.parallel = parallel # colors in parallel threads
+        # lookup table instead of the HSV conversion, colors on the border of a threshold can
+        # get another class (fallback_detector_test.py prints the agreement)
+        self.lut = loadColorLut() if use_lut else None
+        self.output_size = output_size # (width, height) of the boxes, None = size of the frame
+        self.roi = None
+        self.boxes, self.scores, self.class_ids = [], [], []
+
+    def set_roi(self, roi, cone_band=None):
+        # same region of interest as Yolo.set_roi, the cone band is not used
+        self.roi = roi
+
+    def detect(self, frame):
+        class_mask = lutClassMask(frame, self.lut) if self.lut is not None else None
+        boxes, class_ids = detectCones(frame, self.parallel, class_mask)
+        if len(boxes) == 0:
+            return [], [], []
+        # a shape test gives no confidence, every cone counts the same
+        return boxes, np.ones(len(boxes), dtype=np.float32), class_ids
+
+    def propose(self, frame):
+        # crops around the cone colored regions for split computing, YOLO on the computer
+        # decides which ones are cones
+        if self.lut is not None:
+            class_mask = lutClassMask(frame, self.lut)
+        else:
+            class_mask = classMask(frame)
+        class_ids = range(len(cone_colors))
+        if self.parallel:
+            stats = list(executor.map(lambda class_id: colorProposals(class_mask, class_id), class_ids))
+        else:
+            stats = [colorProposals(class_mask, class_id) for class_id in class_ids]
+        return proposalCrops(np.concatenate(stats), frame.shape[:2])
+
+    def feed_forward(self, frame):
+        height, width = frame.shape[:2]
+        # the roi and the boxes are in pixels of output_size (None = pixels of the frame)
+        x_scale = y_scale = 1.0
+        offset = (0, 0)
+        if self.roi is not None and frame.shape[:2] == (self.roi[3] - self.roi[1], self.roi[2] - self.roi[0]):
+            # the client cropped the frame to the roi already
+            offset = (self.roi[0], self.roi[1])
+        else:
+            if self.output_size is not None:
+                x_scale = self.output_size[0] / width
+                y_scale = self.output_size[1] / height
+            if self.roi is not None:
+                # roi in pixels of the frame (full resolution frame of tiled inference)
+                x0, y0, x1, y1 = self.roi
+                x0, x1 = int(x0 / x_scale), int(x1 / x_scale)
+                y0, y1 = int(y0 / y_scale), int(y1 / y_scale)
+                frame = frame[y0:y1, x0:x1]
+                offset = (x0, y0)
+        boxes, scores, class_ids = self.detect(frame)
+        if len(scores) > 0:
+            boxes += np.array([offset[0], offset[1], offset[0], offset[1]], dtype=np.float32)
+            boxes *= np.array([x_scale, y_scale] * 2, dtype=np.float32)
+        self.boxes, self.scores, self.class_ids = boxes, scores, class_ids
+        return self.boxes, self.scores, self.class_ids
+
+    def xyxyBoxes_to_bottom_centerpoints(self, boxes):
+        return bottom_centerpoints(boxes)
@@ -1,5 +1,4 @@
 import cv2
-from matplotlib import pyplot as plt
 
 def readImage(path):
     return cv2.imread(path) # cv2.cvtColor(cv2.imread(path),cv2.COLOR_BGR2RGB)
@@ -8,6 +7,8 @@ def Rgb2HsvImage(img):
     return cv2.cvtColor(img, cv2.COLOR_RGB2HSV)
 
 def showImage(img):
+    # matplotlib takes seconds to import on the raspberry pi, only when showing
+    from matplotlib import pyplot as plt
     plt.imshow(cv2.cvtColor(img,cv2.COLOR_BGR2RGB))
     plt.show()
     return
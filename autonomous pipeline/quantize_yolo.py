@@ -0,0 +1,109 @@
+'''imports'''
+import glob
+import os
+import time
+
+import cv2
+import numpy as np
+from onnxruntime.quantization import quantize_static, CalibrationDataReader, QuantFormat, QuantType
+from onnxruntime.quantization.shape_inference import quant_pre_process
+
+'''personal imports'''
+from rpi3Bplus.classes.yolo_onnx import Yolo, quantized_model_path
+from rpi3Bplus.classes.utils_onnx import match_detections
+
+# makes a statically quantized INT8 copy of the YOLO model, calibrated on frames of the
+# test images and recorded runs, and compares it with the FP32 model
+onnx_path = "rpi3Bplus/data/YOLOv8n_FSOCO.onnx"
+image_paths = sorted(glob.glob("testimages/*-small.jpg"))
+video_paths = sorted(glob.glob("trackdrive_videos/**/*.avi", recursive=True))
+video_frame_step = 10 # every 10th frame of a recorded run
+max_frames = 200
+# only convolutions are quantized, the detection head (box decoding, concat) stays in float
+op_types_to_quantize = ["Conv"]
+iou_match = 0.5 # boxes of both models with the same class and at least this IoU agree
+
+'''functions'''
+def load_frames():
+    frames = [cv2.imread(path) for path in image_paths]
+    for path in video_paths:
+        capture = cv2.VideoCapture(path)
+        index = 0
+        while len(frames) < max_frames:
+            ret, frame = capture.read()
+            if not ret:
+                break
+            if index % video_frame_step == 0:
+                frames.append(frame)
+            index += 1
+        capture.release()
+    return frames[:max_frames]
+
+class FrameDataReader(CalibrationDataReader):
+    # feeds the calibration frames with exactly the preprocessing used at inference
+    def __init__(self, model, frames):
+        self.model = model
+        self.frames = iter(frames)
+
+    def get_next(self):
+        frame = next(self.frames, None)
+        if frame is None:
+            return None
+        # preprocess_input reuses its buffer, the calibrator keeps the inputs
+        return {self.model.input_names[0]: self.model.preprocess_input(frame).copy()}
+
+def run_model(model, frames):
+    times = []
+    results = []
+    for frame in frames:
+        t0 = time.perf_counter()
+        boxes, scores, class_ids = model.feed_forward(frame)
+        times.append(time.perf_counter() - t0)
+        results.append((boxes, scores, class_ids))
+    return float(np.median(times)), results
+
+'''main'''
+frames = load_frames()
+print(f"{len(frames)} frames ({len(image_paths)} images, {len(video_paths)} videos)")
+
+fp32_model = Yolo(onnx_path)
+
+# shape inference and graph cleanup recommended before static quantization
+preprocessed_path = onnx_path.replace(".onnx", "_preprocessed.onnx")
+quant_pre_process(onnx_path, preprocessed_path)
+
+int8_path = quantized_model_path(onnx_path)
+start_time = time.perf_counter()
+quantize_static(preprocessed_path, int8_path, FrameDataReader(fp32_model, frames),
+                quant_format=QuantFormat.QDQ, activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8,
+                per_channel=True, op_types_to_quantize=op_types_to_quantize)
+os.remove(preprocessed_path)
+print(f"Quantized model written to {int8_path} ({(time.perf_counter() - start_time):.1f} s)")
+
+int8_model = Yolo(int8_path)
+
+# calibration frames are used for the comparison as well, there are not enough recordings
+# to keep a separate set
+fp32_time, fp32_results = run_model(fp32_model, frames)
+int8_time, int8_results = run_model(int8_model, frames)
+
+matched = 0
+fp32_count = 0
+int8_count = 0
+ious = []
+for reference, other in zip(fp32_results, int8_results):
+    frame_matched, frame_fp32, frame_int8, frame_ious = match_detections(reference, other, iou_match)
+    matched += frame_matched
+    fp32_count += frame_fp32
+    int8_count += frame_int8
+    ious += frame_ious
+
+print(f"Model\tSize\tLatency (median)\tCones")
+print(f"FP32\t{os.path.getsize(onnx_path)/1e6:.1f} MB\t{fp32_time*1000:.2f} ms\t{fp32_count}")
+print(f"INT8\t{os.path.getsize(int8_path)/1e6:.1f} MB\t{int8_time*1000:.2f} ms\t{int8_count}")
+print(f"Speedup: {fp32_time/int8_time:.2f}x")
+if fp32_count + int8_count > 0:
+    print(f"Detection agreement (F1): {2*matched/(fp32_count + int8_count)*100:.1f} %")
+    print(f"FP32 cones found by INT8: {matched}/{fp32_count}")
+if len(ious) > 0:
+    print(f"Mean IoU of matched cones: {np.mean(ious):.3f}")
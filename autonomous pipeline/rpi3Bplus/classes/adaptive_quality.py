@@ -0,0 +1,69 @@
+class AdaptiveQuality():
+    # closed loop control of the JPEG quality and the frame resolution sent to the computer,
+    # based on the measured round trip (send frame -> receive path) and the payload size
+    def __init__(self, target_latency=0.1, quality_bounds=(50, 90), scale_bounds=(0.5, 1.0),
+                 quality_step=10, scale_step=0.125, tolerance=0.2, smoothing=0.3, cooldown=5):
+        self.target_latency = target_latency # seconds
+        self.tolerance = tolerance # no change within target_latency +- tolerance
+        self.smoothing = smoothing # weight of a new measurement in the moving average
+        self.cooldown = cooldown # frames to wait after a change before the next one
+
+        # levels from best to worst, quality is lowered first, the resolution only
+        # when the quality is already at its lower bound
+        self.levels = []
+        scale = scale_bounds[1]
+        while scale >= scale_bounds[0] - 1e-6:
+            quality = quality_bounds[1]
+            while quality >= quality_bounds[0]:
+                self.levels.append((round(scale, 3), quality))
+                quality -= quality_step
+            scale -= scale_step
+        self.level = 0
+        self.scale, self.quality = self.levels[self.level]
+        # average payload size per level, to know how far to go down
+        self.level_payload = [None] * len(self.levels)
+
+        self.latency = None
+        self.payload_size = None
+        self.frames_since_change = 0
+
+    def update(self, round_trip, payload_size):
+        if self.latency is None:
+            self.latency = round_trip
+            self.payload_size = payload_size
+        else:
+            self.latency += self.smoothing * (round_trip - self.latency)
+            self.payload_size += self.smoothing * (payload_size - self.payload_size)
+        if self.level_payload[self.level] is None:
+            self.level_payload[self.level] = payload_size
+        else:
+            self.level_payload[self.level] += self.smoothing * (payload_size - self.level_payload[self.level])
+
+        self.frames_since_change += 1
+        if self.frames_since_change < self.cooldown:
+            return
+
+        if self.latency > self.target_latency * (1 + self.tolerance):
+            # payload that would have been sent in time if the link is the bottleneck,
+            # skip levels that are known to still be too big
+            wanted_payload = self.payload_size * self.target_latency / self.latency
+            level = self.level + 1
+            while level + 1 < len(self.levels) and self.level_payload[level] is not None \
+                    and self.level_payload[level] > wanted_payload:
+                level += 1
+            self.set_level(level)
+        elif self.latency < self.target_latency * (1 - self.tolerance):
+            # one level at a time back up, a too big step makes the link oscillate
+            self.set_level(self.level - 1)
+
+    def set_level(self, level):
+        level = max(0, min(level, len(self.levels) - 1))
+        if level != self.level:
+            self.level = level
+            self.scale, self.quality = self.levels[self.level]
+            self.frames_since_change = 0
+            # old average is from the previous level
+            self.latency = None
+
+    def get_state(self):
+        return self.scale, self.quality, self.latency
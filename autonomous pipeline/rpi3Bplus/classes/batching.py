@@ -0,0 +1,71 @@
+import threading
+import queue
+import time
+
+class DetectionRequest():
+    def __init__(self, frame):
+        self.frame = frame
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+    def wait(self):
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+class BatchedDetector(threading.Thread):
+    # collects the frames of all connected clients and runs them through the onnx session
+    # as one batch, a batch is run when it is full or max_delay after its first frame
+    def __init__(self, model, max_batch_size=8, max_delay=0.01):
+        super().__init__(name="BatchedDetector", daemon=True)
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay # seconds
+        self.requests = queue.Queue()
+        # statistics
+        self.batches = 0
+        self.frames = 0
+
+    def detect(self, frame):
+        # called from the client threads, blocks until the batch with this frame is done
+        request = DetectionRequest(frame)
+        self.requests.put(request)
+        return request.wait()
+
+    def collect_batch(self):
+        batch = [self.requests.get()]
+        deadline = time.perf_counter() + self.max_delay
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.requests.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def detect_batch(self, frames):
+        return self.model.feed_forward_batch(frames)
+
+    def run(self):
+        while True:
+            batch = self.collect_batch()
+            try:
+                results = self.detect_batch([request.frame for request in batch])
+                for request, result in zip(batch, results):
+                    request.result = result
+            except Exception as error:
+                for request in batch:
+                    request.error = error
+            for request in batch:
+                request.done.set()
+            self.batches += 1
+            self.frames += len(batch)
+
+    def get_average_batch_size(self):
+        if self.batches == 0:
+            return 0
+        return self.frames / self.batches
@@ -1,38 +1,139 @@
 import cv2
+import numpy as np
+import threading
+import time
 '''
 from picamera import PiCamera
 from picamera.array import PiRGBArray
 '''
 
+# seconds to wait after a failed cap.read before trying again
+retry_delay = 0.01
+
 class Camera:
-    def __init__(self, fps):
+    def __init__(self, fps, threaded=True, buffer_size=3, pool_size=4, mjpeg_passthrough=False, read_timeout=2.0):
         self.cap = cv2.VideoCapture(0)
         self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
         self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
         self.cap.set(cv2.CAP_PROP_FPS, 32)
-        
+
+        # let the USB camera compress the frames and hand over the JPEG bytes untouched,
+        # decoding, rotating and resizing is then done by the computer
+        self.mjpeg_passthrough = mjpeg_passthrough
+        if self.mjpeg_passthrough:
+            self.cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*'MJPG'))
+            self.cap.set(cv2.CAP_PROP_CONVERT_RGB, 0)
+
         '''
         self.camera = PiCamera()
         self.camera.resolution = (640, 480)
         self.camera.framerate = 32
         self.rawCapture = PiRGBArray(self.camera)
         '''
-    
-    def get_frame_homo(self, frame_width, frame_height):
-        self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, frame_width)
-        self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, frame_height)
 
-        ret, image = self.cap.read()
+        # reusable buffers for get_frame: resize into a scratch buffer and rotate into
+        # one of the output buffers, the pool lets consumers keep a frame for a while
+        self.full_size = (448, 448)
+        self.pool_size = pool_size
+        self.set_output_size(self.full_size)
 
-        self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
-        self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
+        # grab frames continuously in the background so get_frame does not have to
+        # wait on cap.read() and never gets a stale frame out of the V4L2 queue
+        self.threaded = threaded
+        if self.threaded:
+            # ring buffer of (timestamp, image), older slots stay valid for a few frames
+            self.buffer = [None] * buffer_size
+            self.images = [np.empty((480, 640, 3), dtype=np.uint8) for i in range(buffer_size)]
+            self.index = -1
+            self.frame_counter = 0
+            self.condition = threading.Condition()
+            self.read_timeout = read_timeout # seconds without a new frame before read raises
+            self.running = True
+            self.thread = threading.Thread(target=self.grab_frames, daemon=True)
+            self.thread.start()
+
+    def grab_frames(self):
+        while self.running:
+            # read into the slot after the newest one, the newest stays readable
+            next_index = (self.index + 1) % len(self.buffer)
+            if self.mjpeg_passthrough:
+                # size of a compressed frame changes every frame
+                ret, image = self.cap.read()
+            else:
+                ret, image = self.cap.read(self.images[next_index])
+            timestamp = time.perf_counter()
+            if not ret:
+                # camera not ready or unplugged, do not spin on a core
+                time.sleep(retry_delay)
+                continue
+            # cap.read allocates a new image if the slot does not match the resolution
+            self.images[next_index] = image
+            with self.condition:
+                self.index = next_index
+                self.buffer[self.index] = (timestamp, image)
+                self.frame_counter += 1
+                self.condition.notify_all()
+
+    def read(self, wait_for_new=False):
+        # returns the newest frame with its capture timestamp (time.perf_counter)
+        if not self.threaded:
+            ret, image = self.cap.read()
+            return time.perf_counter(), image
+        with self.condition:
+            if wait_for_new or self.index < 0:
+                counter = self.frame_counter
+                if not self.condition.wait_for(lambda: self.frame_counter > counter, self.read_timeout):
+                    raise TimeoutError("camera delivered no frame for {} s".format(self.read_timeout))
+            return self.buffer[self.index]
+
+    def stop(self):
+        if self.threaded:
+            self.running = False
+            self.thread.join()
+        self.cap.release()
+
+    def read_image(self, wait_for_new=False):
+        # same as read but always a decoded image
+        timestamp, image = self.read(wait_for_new)
+        if self.mjpeg_passthrough:
+            image = cv2.imdecode(image, cv2.IMREAD_COLOR)
+        return timestamp, image
+
+    def get_jpeg(self, wait_for_new=False):
+        # compressed frame exactly as the camera sent it (not rotated, not resized)
+        jpeg, timestamp = self.get_jpeg_timestamped(wait_for_new)
+        return jpeg
+
+    def get_jpeg_timestamped(self, wait_for_new=False):
+        timestamp, jpeg = self.read(wait_for_new)
+        return jpeg, timestamp
+
+    def get_frame_homo(self, frame_width, frame_height):
+        # scaled from the running stream, switching the capture resolution would
+        # restart the camera stream twice
+        timestamp, image = self.read_image()
+        if image.shape[1] != frame_width or image.shape[0] != frame_height:
+            image = cv2.resize(image, (frame_width, frame_height))
 
         frame = cv2.rotate(image, cv2.ROTATE_180)
         return frame
 
-    def get_frame(self):
-        ret, image = self.cap.read()
-        rotated_image = cv2.rotate(image, cv2.ROTATE_180)
+    def set_output_size(self, size):
+        self.output_size = size
+        self.resized_image = np.empty((size[1], size[0], 3), dtype=np.uint8)
+        self.output_pool = [np.empty_like(self.resized_image) for i in range(self.pool_size)]
+        self.pool_index = 0
+
+    def get_frame(self, wait_for_new=False, scale=1.0):
+        frame, timestamp = self.get_frame_timestamped(wait_for_new, scale)
+        return frame
+
+    def get_frame_timestamped(self, wait_for_new=False, scale=1.0):
+        # scale < 1 gives a smaller frame in one resize (adaptive quality)
+        size = (round(self.full_size[0]*scale), round(self.full_size[1]*scale))
+        if size != self.output_size:
+            self.set_output_size(size)
+        timestamp, image = self.read_image(wait_for_new)
         '''
         self.rawCapture.truncate(0)
         self.camera.capture(self.rawCapture, "bgr")
@@ -41,5 +142,10 @@ class Camera:
         # cv2.imshow("image", image)
         # cv2.waitKey(0)
         # frame = cv2.imdecode(image, cv2.IMREAD_COLOR)
-        frame = cv2.resize(rotated_image, (448, 448))
-        return frame
\ No newline at end of file
+        # resizing before rotating gives the same frame, the rotation then works on the
+        # smaller image, both steps write into preallocated buffers
+        cv2.resize(image, self.output_size, dst=self.resized_image)
+        frame = self.output_pool[self.pool_index]
+        self.pool_index = (self.pool_index + 1) % len(self.output_pool)
+        cv2.flip(self.resized_image, -1, dst=frame) # -1 flips both axes = rotate 180
+        return frame, timestamp
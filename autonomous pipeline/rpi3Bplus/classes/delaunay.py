@@ -1,4 +1,3 @@
-from scipy import spatial
 from math import sqrt, pow
 import numpy as np
 
@@ -20,6 +19,9 @@ def getDistance(point0, point1):
 
 class Delaunay:
     def __init__(self):
+        # scipy takes long to import on the raspberry pi, only when path-planning is used
+        from scipy import spatial
+        self.spatial = spatial
         self.blue_edges = []
         self.yellow_edges = []
         self.mixed_edges = []
@@ -32,7 +34,7 @@ class Delaunay:
 
         # calculate delaunay_triangles
         delaunay_input = np.array([coordinate[0] for coordinate in coordinates])
-        delaunay_triangles = spatial.Delaunay(delaunay_input)
+        delaunay_triangles = self.spatial.Delaunay(delaunay_input)
 
         for triangle in delaunay_triangles.simplices:
             point0 = delaunay_input[triangle[0]]
@@ -0,0 +1,41 @@
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+from classes.utils_onnx import DetectorWrapper
+
+class DeadlineDetector(DetectorWrapper):
+    # runs the primary detector (YOLO) in a worker thread, a frame it does not finish within
+    # deadline gets the boxes of the fallback detector (HSV) instead. The late YOLO run is
+    # not stopped, while it is still busy the next frames go straight to the fallback
+    def __init__(self, primary, fallback, deadline=0.1):
+        super().__init__(primary)
+        self.primary = primary
+        self.fallback = fallback
+        self.deadline = deadline # seconds
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.pending = None
+        # statistics
+        self.frames = 0
+        self.fallbacks = 0
+
+    def feed_forward(self, frame):
+        self.frames += 1
+        busy = self.pending is not None and not self.pending.done()
+        if not busy:
+            self.pending = self.executor.submit(self.primary.feed_forward, frame)
+            try:
+                self.boxes, self.scores, self.class_ids = self.pending.result(timeout=self.deadline)
+                return self.boxes, self.scores, self.class_ids
+            except TimeoutError:
+                pass
+        self.fallbacks += 1
+        self.boxes, self.scores, self.class_ids = self.fallback.feed_forward(frame)
+        return self.boxes, self.scores, self.class_ids
+
+    def get_fallback_ratio(self):
+        if self.frames == 0:
+            return 0
+        return self.fallbacks / self.frames
+
+    def set_roi(self, roi, cone_band=None):
+        self.primary.set_roi(roi, cone_band)
+        self.fallback.set_roi(roi, cone_band)
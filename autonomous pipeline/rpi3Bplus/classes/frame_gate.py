@@ -0,0 +1,39 @@
+import cv2
+import numpy as np
+
+class FrameGate():
+    # cheap check if a frame is nearly the same as the last frame the pipeline ran on (car
+    # stopped, braking or crawling), its detections and path can be used again
+    def __init__(self, threshold=2.0, size=(32, 32), max_reuse=10):
+        self.threshold = threshold # mean absolute difference of the small gray frames (0 to 255)
+        self.size = size # (width, height) the frames are compared at
+        self.max_reuse = max_reuse # frames in a row that can be reused, then the pipeline runs anyway
+        self.reference = None
+        self.reused = 0
+        # statistics
+        self.frames = 0
+        self.hits = 0
+
+    def thumbnail(self, frame):
+        # shrink first, the gray conversion then only works on a few pixels
+        small = cv2.resize(frame, self.size, interpolation=cv2.INTER_AREA)
+        return cv2.cvtColor(small, cv2.COLOR_BGR2GRAY).astype(np.int16)
+
+    def is_duplicate(self, frame):
+        self.frames += 1
+        thumbnail = self.thumbnail(frame)
+        if self.reference is not None and self.reused < self.max_reuse:
+            if np.mean(np.abs(thumbnail - self.reference)) < self.threshold:
+                self.hits += 1
+                self.reused += 1
+                return True
+        # compared with the last frame that was run and not the previous one, so a slow
+        # drift over several frames is not missed
+        self.reference = thumbnail
+        self.reused = 0
+        return False
+
+    def get_hit_ratio(self):
+        if self.frames == 0:
+            return 0
+        return self.hits / self.frames
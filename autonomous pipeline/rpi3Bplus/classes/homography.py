@@ -28,6 +28,8 @@ class Homography:
         if ret == True:
             srcCorners2 = cv2.cornerSubPix(grayImage, srcCorners, (5, 5), (-1, -1), self.criteria)
             self.homographyMask, _ = cv2.findHomography(srcCorners2, self.dstCorners)
+            # a pixel known to be on the ground, to tell ground from sky in groundPoints
+            self.chessboardCenter = srcCorners2.reshape(-1, 2).mean(axis=0)
 
             # for test
             '''
@@ -60,4 +62,63 @@ class Homography:
         for index in range(len(world_coordinates)):
             world_coordinates[index][0] = [world_coordinates[index][0][0]*3/4,
                                            world_coordinates[index][0][1]*3/4 + self.distance_grid]
-        return world_coordinates
\ No newline at end of file
+        return world_coordinates
+
+    def groundPoints(self, pixel_coordinates):
+        # vectorized perspectiveTransform, returns world x, y (mm) and whether the pixel is
+        # below the horizon (the homogeneous coordinate has the same sign as for the chessboard)
+        points = np.asarray(pixel_coordinates, dtype=np.float64).reshape(-1, 2)
+        mapped = np.column_stack([points, np.ones(len(points))]) @ self.homographyMask.T
+        with np.errstate(divide="ignore", invalid="ignore"):
+            x = mapped[:, 0] / mapped[:, 2] * 3/4
+            y = mapped[:, 1] / mapped[:, 2] * 3/4 + self.distance_grid
+        chessboard_sign = np.sign(self.homographyMask[2] @ np.append(self.chessboardCenter, 1))
+        return x, y, np.sign(mapped[:, 2]) == chessboard_sign
+
+    def groundDistance(self, pixel_coordinates):
+        # distance (mm) from the car to the ground point under every pixel, infinity above the horizon
+        x, y, on_ground = self.groundPoints(pixel_coordinates)
+        distance = np.hypot(x, y)
+        distance[~on_ground] = np.inf
+        return distance
+
+    def conePixelHeights(self, frame_size, cone_height):
+        # expected height in pixels of a cone (cone_height in mm) standing on every row of the
+        # frame, at the same depth the vertical scale of the camera equals the horizontal one
+        height, width = frame_size
+        rows = np.arange(height)
+        centre = np.full(height, width / 2)
+        x, y, on_ground = self.groundPoints(np.column_stack([centre, rows]))
+        x_next, y_next, on_ground_next = self.groundPoints(np.column_stack([centre + 1, rows]))
+        # the horizon row maps to infinity (inf - inf)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            mm_per_pixel = np.hypot(x_next - x, y_next - y)
+            heights = cone_height / mm_per_pixel
+        # above the horizon no cone can stand
+        heights[~(on_ground & on_ground_next)] = 0
+        return np.nan_to_num(heights, nan=0, posinf=0)
+
+    def calculateConeBand(self, frame_size, cone_height, tolerance=0.5):
+        # (min heights, max heights) per row, boxes outside the band are no cone on the ground
+        heights = self.conePixelHeights(frame_size, cone_height)
+        return heights * (1 - tolerance), heights * (1 + tolerance)
+
+    def calculateRoi(self, frame_size, max_distance, cone_height=None, margin=32, step=4):
+        # pixel region (x0, y0, x1, y1) with every ground point closer than max_distance (mm),
+        # cones past the planning horizon or above the horizon are of no use to path-planning
+        height, width = frame_size
+        rows, columns = np.mgrid[0:height:step, 0:width:step]
+        distance = self.groundDistance(np.column_stack([columns.ravel(), rows.ravel()])).reshape(rows.shape)
+        in_range = distance <= max_distance
+        if not np.any(in_range):
+            return (0, 0, width, height)
+        in_range_rows = np.nonzero(np.any(in_range, axis=1))[0]
+        in_range_columns = np.nonzero(np.any(in_range, axis=0))[0]
+        top = in_range_rows[0] * step
+        # a cone on the farthest row still reaches above it
+        if cone_height is not None:
+            margin = int(np.ceil(self.conePixelHeights(frame_size, cone_height)[top]))
+        x0 = max(0, in_range_columns[0] * step - margin)
+        x1 = min(width, in_range_columns[-1] * step + step + margin)
+        y0 = max(0, top - margin)
+        return (int(x0), int(y0), int(x1), int(height))
@@ -0,0 +1,106 @@
+import threading
+import queue
+import time
+
+class LatestQueue():
+    # bounded queue, when full the oldest item is dropped ("latest frame wins")
+    def __init__(self, maxsize=1):
+        self.queue = queue.Queue(maxsize)
+        self.dropped = 0
+
+    def put(self, item):
+        while True:
+            try:
+                self.queue.put_nowait(item)
+                return
+            except queue.Full:
+                try:
+                    self.queue.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+    def get(self, timeout=None):
+        return self.queue.get(timeout=timeout)
+
+class Stage(threading.Thread):
+    def __init__(self, name, function, input_queue=None, output_queue=None, stop_event=None):
+        super().__init__(name=name, daemon=True)
+        self.function = function
+        self.input_queue = input_queue
+        self.output_queue = output_queue
+        self.stop_event = stop_event if stop_event is not None else threading.Event()
+        self.error = None
+        # statistics
+        self.counter = 0
+        self.busy_time = 0
+
+    def run(self):
+        try:
+            while not self.stop_event.is_set():
+                if self.input_queue is None:
+                    # first stage, produces its own items
+                    t0 = time.perf_counter()
+                    result = self.function()
+                else:
+                    try:
+                        item = self.input_queue.get(timeout=0.1)
+                    except queue.Empty:
+                        continue
+                    t0 = time.perf_counter()
+                    result = self.function(item)
+                self.busy_time += time.perf_counter() - t0
+                self.counter += 1
+
+                # None means nothing to pass on (item consumed or skipped)
+                if result is not None and self.output_queue is not None:
+                    self.output_queue.put(result)
+        except Exception as error:
+            self.error = error
+            self.stop_event.set()
+
+    def get_average_time(self):
+        if self.counter == 0:
+            return 0
+        return self.busy_time / self.counter
+
+class Pipeline():
+    def __init__(self, queue_size=1):
+        self.queue_size = queue_size
+        self.stop_event = threading.Event()
+        self.stages = []
+
+    def add_stage(self, name, function):
+        input_queue = None
+        if len(self.stages) > 0:
+            # every stage reads from a bounded queue filled by the previous stage
+            input_queue = LatestQueue(self.queue_size)
+            self.stages[-1].output_queue = input_queue
+        stage = Stage(name, function, input_queue, None, self.stop_event)
+        self.stages.append(stage)
+        return stage
+
+    def start(self):
+        for stage in self.stages:
+            stage.start()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def is_running(self):
+        return not self.stop_event.is_set()
+
+    def join(self, timeout=None):
+        for stage in self.stages:
+            stage.join(timeout)
+        for stage in self.stages:
+            if stage.error is not None:
+                raise stage.error
+
+    def get_timings(self):
+        # average busy time (s) per stage and number of frames dropped in front of it
+        timings = []
+        for stage in self.stages:
+            dropped = stage.input_queue.dropped if stage.input_queue is not None else 0
+            timings.append((stage.name, stage.get_average_time(), stage.counter, dropped))
+        return timings
@@ -1,86 +1,534 @@
 import socket
 import cv2
-import pickle
+import numpy as np
 import struct
 import time
+from multiprocessing import shared_memory, resource_tracker
 
-encode_param = [int(cv2.IMWRITE_JPEG_QUALITY), 90]
-payload_size = struct.calcsize(">L")
+jpeg_quality = 90
+frame_size = (448, 448)
+connect_attempt_timeout = 2.0 # seconds, one connection attempt of Client.connect
+
+'''wire format'''
+# every message = fixed header + payload
+# header: magic, version, message type, flags, frame scale (percent), payload length (little endian)
+header = struct.Struct("<2sBBBBI")
+magic = b"TD"
+version = 2
+# message types
+MSG_FRAME = 1 # payload: raw JPEG bytes
+MSG_PATH = 2 # payload: path as float32 [x, y] pairs
+MSG_SHM_SETUP = 3 # payload: shm_setup
+MSG_SHM_FRAME = 4 # payload: shm_frame, frame itself is in shared memory
+MSG_SHM_PATH = 5 # payload: shm_path, path itself is in shared memory
+MSG_ROI = 6 # payload: region_of_interest, region of the frame the client only has to send
+MSG_CROPS = 7 # payload: crops_header, then per crop crop_header + JPEG bytes (split computing)
+MSG_READY = 8 # no payload, server is warmed up, sent in front of the first path
+# frame flags
+FLAG_PASSTHROUGH = 1 # frame as the camera captured it (not rotated, not resized)
+
+path_dtype = np.dtype("<f4")
+
+# shared memory notifications
+shm_setup = struct.Struct("<BII") # slots, frame slot size, path slot size
+shm_frame = struct.Struct("<BIHHB") # slot, bytes, height, width, channels (height 0 = JPEG bytes)
+shm_path = struct.Struct("<BI") # slot, number of points
+
+# region of interest
+region_of_interest = struct.Struct("<HHHH") # x0, y0, x1, y1 in pixels of a full size frame
+
+# split computing
+crops_header = struct.Struct("<HHH") # width, height of the frame the crops are cut from, number of crops
+crop_header = struct.Struct("<HHI") # x0, y0 in the frame, JPEG bytes
+
+def encode_frame(frame, quality=jpeg_quality):
+    result, jpeg = cv2.imencode('.jpg', frame, [int(cv2.IMWRITE_JPEG_QUALITY), quality])
+    return jpeg
+
+def decode_frame(frame_data, passthrough=False, scale=1.0, full_resolution=False):
+    # frame_data can be a memoryview into the receive buffer, imdecode reads it in place
+    frame = cv2.imdecode(np.frombuffer(frame_data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    return orient_frame(frame, passthrough, scale, full_resolution)
+
+def orient_frame(frame, passthrough=False, scale=1.0, full_resolution=False):
+    if passthrough:
+        # frame as the camera captured it, do what Camera.get_frame does on the pi,
+        # full_resolution keeps the capture size (tiled inference)
+        if full_resolution:
+            return cv2.flip(frame, -1)
+        frame = cv2.flip(cv2.resize(frame, frame_size), -1)
+    elif scale != 1.0:
+        # client sent a smaller frame, back to full size so box coordinates match
+        # the homography (calculated on a full size frame). Not width/scale, the scale is
+        # sent in whole percent (0.875 arrives as 0.88)
+        frame = cv2.resize(frame, frame_size)
+    return frame
+
+def encode_crops(frame, boxes, quality=jpeg_quality):
+    # one payload with the JPEG of every box (x0, y0, x1, y1) of the frame
+    height, width = frame.shape[:2]
+    parts = [crops_header.pack(width, height, len(boxes))]
+    for x0, y0, x1, y1 in boxes:
+        jpeg = encode_frame(frame[y0:y1, x0:x1], quality)
+        parts.append(crop_header.pack(x0, y0, len(jpeg)))
+        parts.append(jpeg.tobytes())
+    return b"".join(parts)
+
+def decode_crops(crops_data):
+    # returns (crops, offsets (x0, y0) per crop, (width, height) of the frame)
+    width, height, count = crops_header.unpack_from(crops_data, 0)
+    position = crops_header.size
+    crops = []
+    offsets = np.zeros((count, 2), dtype=np.float32)
+    for index in range(count):
+        x0, y0, size = crop_header.unpack_from(crops_data, position)
+        position += crop_header.size
+        crops.append(cv2.imdecode(np.frombuffer(crops_data[position:position+size], dtype=np.uint8), cv2.IMREAD_COLOR))
+        offsets[index] = (x0, y0)
+        position += size
+    return crops, offsets, (width, height)
+
+def paste_crops(crops, offsets, frame_size):
+    # black frame with only the crops filled in (recording)
+    frame = np.zeros((frame_size[1], frame_size[0], 3), dtype=np.uint8)
+    for crop, (x0, y0) in zip(crops, offsets.astype(int)):
+        height, width = crop.shape[:2]
+        frame[y0:y0+height, x0:x0+width] = crop
+    return frame
+
+def scale_to_percent(scale):
+    return int(round(scale * 100))
+
+def encode_path(path):
+    return np.asarray(path, dtype=path_dtype).reshape(-1, 2)
+
+def decode_path(path_data):
+    # copy, the receive buffer is reused for the next message
+    return np.frombuffer(path_data, dtype=path_dtype).reshape(-1, 2).copy()
+
+class Connection():
+    # receives messages with recv_into in one preallocated buffer, bytes received
+    # after a message are kept for the next one
+    def __init__(self, sock, buffer_size=1<<20):
+        self.sock = sock
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.buffer = bytearray(buffer_size)
+        self.view = memoryview(self.buffer)
+        self.start = 0 # first byte not yet read
+        self.end = 0 # end of received bytes
+
+    def send_message(self, msg_type, payload, flags=0, scale=100):
+        payload = memoryview(payload).cast("B")
+        # two sends instead of concatenating to not copy the payload (TCP_NODELAY is set)
+        self.sock.sendall(header.pack(magic, version, msg_type, flags, scale, len(payload)))
+        self.sock.sendall(payload)
+
+    def fill(self, size):
+        # make sure at least size unread bytes are in the buffer
+        if self.start + size > len(self.buffer):
+            unread = bytes(self.view[self.start:self.end])
+            if size > len(self.buffer):
+                self.buffer = bytearray(max(size, 2*len(self.buffer)))
+                self.view = memoryview(self.buffer)
+            self.buffer[:len(unread)] = unread
+            self.start = 0
+            self.end = len(unread)
+        while self.end - self.start < size:
+            received = self.sock.recv_into(self.view[self.end:])
+            if received == 0:
+                raise ConnectionError("connection closed")
+            self.end += received
+
+    def recv_message(self):
+        # returns (message type, flags, scale, payload), payload is a memoryview into the
+        # receive buffer and only valid until the next recv_message
+        self.fill(header.size)
+        msg_magic, msg_version, msg_type, flags, scale, size = header.unpack_from(self.buffer, self.start)
+        if msg_magic != magic or msg_version != version:
+            raise ValueError("unknown message: magic {} version {}".format(msg_magic, msg_version))
+        self.start += header.size
+
+        self.fill(size)
+        payload = self.view[self.start:self.start+size]
+        self.start += size
+        return msg_type, flags, scale / 100, payload
+
+    def recv_expected(self, expected_type):
+        msg_type, flags, scale, payload = self.recv_message()
+        if msg_type != expected_type:
+            raise ValueError("expected message type {}, got {}".format(expected_type, msg_type))
+        return flags, scale, payload
 
 class Client():
-    def __init__(self, host, port=8485):
+    def __init__(self, host, port=8485, quality_controller=None, timeout=None, connect_timeout=0):
         self.host = host
         self.port = port
-        self.client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.client_socket.connect((self.host, self.port))
-        self.connection = self.client_socket.makefile('wb')
-    
+        self.client_socket = self.connect(connect_timeout)
+        self.set_timeout(timeout)
+        self.connection = Connection(self.client_socket, buffer_size=4096)
+        # AdaptiveQuality or None for a fixed quality and resolution
+        self.quality_controller = quality_controller
+        # region of interest sent by the server, None = full frame
+        self.roi = None
+        # server sent MSG_READY
+        self.ready = False
+
+    def connect(self, connect_timeout):
+        # the server can still be starting (loading and warming up the model), try again
+        # until connect_timeout seconds have passed
+        deadline = time.perf_counter() + connect_timeout
+        while True:
+            client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            if connect_timeout > 0:
+                # a host that is not on the wifi yet does not refuse, it does not answer at all
+                client_socket.settimeout(connect_attempt_timeout)
+            try:
+                client_socket.connect((self.host, self.port))
+                client_socket.settimeout(None)
+                return client_socket
+            except OSError:
+                # refused, unreachable or timed out
+                client_socket.close()
+                if time.perf_counter() >= deadline:
+                    raise
+                time.sleep(0.5)
+
+    def set_timeout(self, timeout):
+        # seconds without an answer before recv raises socket.timeout (None = wait forever)
+        self.client_socket.settimeout(timeout)
+
+    def get_scale(self):
+        # resolution the next frame should be captured at, relative to the full frame
+        if self.quality_controller is None:
+            return 1.0
+        return self.quality_controller.scale
+
+    def crop_to_roi(self, frame):
+        if self.roi is None:
+            return frame
+        # the frame can be captured at a lower scale, crop relative to its size
+        x0, y0, x1, y1 = self.roi
+        height, width = frame.shape[:2]
+        x_scale = width / frame_size[0]
+        y_scale = height / frame_size[1]
+        return frame[round(y0*y_scale):round(y1*y_scale), round(x0*x_scale):round(x1*x_scale)]
+
+    def encode_frame_data(self, frame):
+        frame = self.crop_to_roi(frame)
+        if self.quality_controller is None:
+            return encode_frame(frame)
+        return encode_frame(frame, self.quality_controller.quality)
+
     def send_frame(self, frame):
-        result, frame = cv2.imencode('.jpg', frame, encode_param)
-        data = pickle.dumps(frame, 0)
-        size = len(data)
+        self.send_frame_data(encode_frame(self.crop_to_roi(frame)))
+
+    def encode_crops_data(self, frame, boxes):
+        # crops of a full size frame, proposals outside the region of interest are not sent
+        if self.roi is not None and len(boxes) > 0:
+            x0, y0, x1, y1 = self.roi
+            inside = (boxes[:, 0] < x1) & (boxes[:, 2] > x0) & (boxes[:, 1] < y1) & (boxes[:, 3] > y0)
+            boxes = boxes[inside]
+        if self.quality_controller is None:
+            return encode_crops(frame, boxes)
+        return encode_crops(frame, boxes, self.quality_controller.quality)
+
+    def send_crops_data(self, data):
+        self.connection.send_message(MSG_CROPS, data)
+
+    def send_frame_data(self, data, passthrough=False, scale=1.0):
+        # sends an already encoded frame, encoding can be done by another thread
+        flags = FLAG_PASSTHROUGH if passthrough else 0
+        self.connection.send_message(MSG_FRAME, data, flags, scale_to_percent(scale))
 
-        # print("{}".format(size))
-        self.client_socket.sendall(struct.pack(">L", size) + data)
-    
     def send_frame_recv_path(self, frame):
         self.send_frame(frame)
+        return self.recv_path()
 
-        # receive path
-        data = b""
-        # print("payload_size: {}".format(payload_size))
-        while len(data) < payload_size:
-            # print("Recv: {}".format(len(data)))
-            data += self.client_socket.recv(4096)
-        
-        # print("Done Recv: {}".format(len(data)))
-        packed_msg_size = data[:payload_size]
-        data = data[payload_size:]
-        msg_size = struct.unpack(">L", packed_msg_size)[0]
-        # print(msg_size)
-        # print("msg_size: {}".format(msg_size))
-        while len(data) < msg_size:
-            data += self.client_socket.recv(4096)
-        path_data = data[:msg_size]
-        data = data[msg_size:]
-        
-
-        path = pickle.loads(path_data, fix_imports=True, encoding="bytes")
+    def send_frame_data_recv_path(self, data, passthrough=False, scale=1.0):
+        t0 = time.perf_counter()
+        self.send_frame_data(data, passthrough, scale)
+        path = self.recv_path()
+        if self.quality_controller is not None:
+            self.quality_controller.update(time.perf_counter() - t0, memoryview(data).nbytes)
         return path
 
-class Server():
+    def send_crops_data_recv_path(self, data):
+        t0 = time.perf_counter()
+        self.send_crops_data(data)
+        path = self.recv_path()
+        if self.quality_controller is not None:
+            self.quality_controller.update(time.perf_counter() - t0, len(data))
+        return path
+
+    def recv_path(self):
+        msg_type, flags, scale, payload = self.connection.recv_message()
+        # the server sends the region of interest and the ready signal in front of a path
+        while msg_type in (MSG_ROI, MSG_READY):
+            if msg_type == MSG_ROI:
+                self.roi = region_of_interest.unpack(payload)
+            else:
+                self.ready = True
+            msg_type, flags, scale, payload = self.connection.recv_message()
+        if msg_type != MSG_PATH:
+            raise ValueError("expected message type {}, got {}".format(MSG_PATH, msg_type))
+        return decode_path(payload)
+
+class ServerConnection():
+    # one connected client, used by Server and by MultiServer (one per car)
+    def __init__(self, conn, addr):
+        self.conn = conn
+        self.addr = addr
+        self.connection = Connection(self.conn)
+        self.roi = None
+
+    def send_roi(self, roi):
+        # client only sends this part of the frame from now on (passthrough frames stay full)
+        self.roi = tuple(int(value) for value in roi)
+        self.connection.send_message(MSG_ROI, region_of_interest.pack(*self.roi))
+
+    def send_ready(self):
+        # model loaded and warmed up, the next paths come in time
+        self.connection.send_message(MSG_READY, b"")
+
+    def recv_frame(self, full_resolution=False):
+        # decoded straight out of the receive buffer
+        flags, scale, frame_data = self.connection.recv_expected(MSG_FRAME)
+        return self.decode_frame_data(frame_data, bool(flags & FLAG_PASSTHROUGH), scale, full_resolution)
+
+    def recv_frame_data(self):
+        # only receives the encoded frame, decoding can be done by another thread,
+        # returns (frame data, passthrough, scale)
+        flags, scale, frame_data = self.connection.recv_expected(MSG_FRAME)
+        # copy, the receive buffer is overwritten by the next frame
+        return bytes(frame_data), bool(flags & FLAG_PASSTHROUGH), scale
+
+    def decode_frame_data(self, frame_data, passthrough, scale=1.0, full_resolution=False):
+        if self.roi is None or passthrough:
+            return decode_frame(frame_data, passthrough, scale, full_resolution)
+        frame = decode_frame(frame_data)
+        # frames sent before the client got the roi are full frames, take the closest size
+        x0, y0, x1, y1 = self.roi
+        shape = np.array(frame.shape[:2])
+        roi_shape = np.array([y1 - y0, x1 - x0])
+        full_shape = np.array([frame_size[1], frame_size[0]])
+        if np.abs(shape - roi_shape*scale).sum() > np.abs(shape - full_shape*scale).sum():
+            return orient_frame(frame, False, scale)
+        if frame.shape[:2] != (y1 - y0, x1 - x0):
+            # exactly the roi size, the detector recognises a cropped frame by its size
+            frame = cv2.resize(frame, (x1 - x0, y1 - y0))
+        return frame
+
+    def recv_crops(self):
+        # split computing, returns (crops, offsets, frame size) as decode_crops
+        flags, scale, crops_data = self.connection.recv_expected(MSG_CROPS)
+        return decode_crops(crops_data)
+
+    def recv_crops_data(self):
+        # copy, the receive buffer is overwritten by the next message
+        flags, scale, crops_data = self.connection.recv_expected(MSG_CROPS)
+        return bytes(crops_data)
+
+    def decode_crops_data(self, crops_data):
+        return decode_crops(crops_data)
+
+    def send_path(self, path):
+        self.connection.send_message(MSG_PATH, encode_path(path))
+
+    def close(self):
+        self.conn.close()
+
+class Server(ServerConnection):
     def __init__(self, port=8485):
         self.host = ''
         self.port = port
         self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.server_socket.bind((self.host, self.port))
         self.server_socket.listen(1)
-        
-        self.conn, self.addr = self.server_socket.accept()
-    
-    def recv_frame(self):
-        data = b""
-        # print("payload_size: {}".format(payload_size))
-        while len(data) < payload_size:
-            # print("Recv: {}".format(len(data)))
-            data += self.conn.recv(4096)
-        
-        # print("Done Recv: {}".format(len(data)))
-        packed_msg_size = data[:payload_size]
-        data = data[payload_size:]
-        msg_size = struct.unpack(">L", packed_msg_size)[0]
-        # print("msg_size: {}".format(msg_size))
-        while len(data) < msg_size:
-            data += self.conn.recv(4096)
-        frame_data = data[:msg_size]
-        data = data[msg_size:]
-
-        frame = pickle.loads(frame_data, fix_imports=True, encoding="bytes")
-        frame = cv2.imdecode(frame, cv2.IMREAD_COLOR)
+
+        conn, addr = self.server_socket.accept()
+        super().__init__(conn, addr)
+
+class MultiServer():
+    # accepts any number of clients (cars, test rigs), every client gets its own ServerConnection
+    def __init__(self, port=8485, backlog=8):
+        self.host = ''
+        self.port = port
+        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server_socket.bind((self.host, self.port))
+        self.server_socket.listen(backlog)
+
+    def accept(self):
+        conn, addr = self.server_socket.accept()
+        return ServerConnection(conn, addr)
+
+    def close(self):
+        self.server_socket.close()
+
+'''shared memory transport'''
+# same API as Client and Server for a client and server on the same computer (bench runs,
+# replays, simulation): raw frames and paths are written in shared memory ring slots, the
+# socket only carries a small notification with the slot, no JPEG and no kernel copies
+def shared_memory_name(port, kind):
+    return "trackdrive_{}_{}".format(port, kind)
+
+def create_shared_memory(name, size):
+    try:
+        return shared_memory.SharedMemory(name=name, create=True, size=size)
+    except FileExistsError:
+        # left behind by a server that did not stop cleanly
+        old_memory = shared_memory.SharedMemory(name=name)
+        old_memory.close()
+        old_memory.unlink()
+        return shared_memory.SharedMemory(name=name, create=True, size=size)
+
+def attach_shared_memory(name):
+    # the server owns the memory, the resource tracker of the client would unlink it
+    # when the client exits
+    memory = shared_memory.SharedMemory(name=name)
+    resource_tracker.unregister(memory._name, "shared_memory")
+    return memory
+
+def unlink_shared_memory(memory):
+    memory.close()
+    try:
+        memory.unlink()
+    except FileNotFoundError:
+        # already removed, e.g. by a client of an older version
+        pass
+
+def slot_array(memory, slot, slot_size, shape, dtype=np.uint8):
+    return np.ndarray(shape, dtype=dtype, buffer=memory.buf, offset=slot*slot_size)
+
+class SharedMemoryClient():
+    def __init__(self, host="localhost", port=8485):
+        self.host = host
+        self.port = port
+        self.client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.client_socket.connect((self.host, self.port))
+        self.connection = Connection(self.client_socket, buffer_size=4096)
+
+        # server created the shared memory before accepting the connection
+        flags, scale, payload = self.connection.recv_expected(MSG_SHM_SETUP)
+        self.slots, self.frame_slot_size, self.path_slot_size = shm_setup.unpack(payload)
+        self.frames = attach_shared_memory(shared_memory_name(self.port, "frames"))
+        self.paths = attach_shared_memory(shared_memory_name(self.port, "paths"))
+        self.frame_slot = 0
+        self.ready = False
+
+    def set_timeout(self, timeout):
+        self.client_socket.settimeout(timeout)
+
+    def encode_frame_data(self, frame):
+        # no encoding, the raw frame is copied in shared memory when it is sent
         return frame
-    
+
+    def send_frame(self, frame):
+        self.send_frame_data(frame)
+
+    def get_scale(self):
+        return 1.0
+
+    def send_frame_data(self, data, passthrough=False, scale=1.0):
+        # data is a raw frame (height, width, channels) or JPEG bytes (MJPEG passthrough)
+        data = np.asarray(data, dtype=np.uint8)
+        if data.ndim != 3:
+            data = data.reshape(-1)
+        if data.nbytes > self.frame_slot_size:
+            raise ValueError("frame of {} bytes does not fit in a shared memory slot".format(data.nbytes))
+
+        slot = self.frame_slot
+        self.frame_slot = (self.frame_slot + 1) % self.slots
+        slot_array(self.frames, slot, self.frame_slot_size, data.shape)[...] = data
+
+        height, width, channels = data.shape if data.ndim == 3 else (0, 0, 0)
+        flags = FLAG_PASSTHROUGH if passthrough else 0
+        self.connection.send_message(MSG_SHM_FRAME, shm_frame.pack(slot, data.nbytes, height, width, channels),
+                                     flags, scale_to_percent(scale))
+
+    def send_frame_recv_path(self, frame):
+        self.send_frame(frame)
+        return self.recv_path()
+
+    def send_frame_data_recv_path(self, data, passthrough=False, scale=1.0):
+        self.send_frame_data(data, passthrough, scale)
+        return self.recv_path()
+
+    def recv_path(self):
+        msg_type, flags, scale, payload = self.connection.recv_message()
+        while msg_type == MSG_READY:
+            self.ready = True
+            msg_type, flags, scale, payload = self.connection.recv_message()
+        if msg_type != MSG_SHM_PATH:
+            raise ValueError("expected message type {}, got {}".format(MSG_SHM_PATH, msg_type))
+        slot, points = shm_path.unpack(payload)
+        return slot_array(self.paths, slot, self.path_slot_size, (points, 2), path_dtype).copy()
+
+    def close(self):
+        self.frames.close()
+        self.paths.close()
+        self.client_socket.close()
+
+class SharedMemoryServer():
+    def __init__(self, port=8485, slots=4, max_frame_size=(640, 480), max_path_points=256):
+        self.host = ''
+        self.port = port
+
+        self.slots = slots
+        self.frame_slot_size = max_frame_size[0] * max_frame_size[1] * 3
+        self.path_slot_size = max_path_points * 2 * path_dtype.itemsize
+        self.max_path_points = max_path_points
+        self.frames = create_shared_memory(shared_memory_name(self.port, "frames"), self.slots*self.frame_slot_size)
+        self.paths = create_shared_memory(shared_memory_name(self.port, "paths"), self.slots*self.path_slot_size)
+        self.path_slot = 0
+
+        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server_socket.bind((self.host, self.port))
+        self.server_socket.listen(1)
+
+        self.conn, self.addr = self.server_socket.accept()
+        self.connection = Connection(self.conn)
+        self.connection.send_message(MSG_SHM_SETUP, shm_setup.pack(self.slots, self.frame_slot_size, self.path_slot_size))
+
+    def recv_shared_frame(self, copy):
+        flags, scale, payload = self.connection.recv_expected(MSG_SHM_FRAME)
+        slot, size, height, width, channels = shm_frame.unpack(payload)
+        shape = (height, width, channels) if height > 0 else (size,)
+        frame_data = slot_array(self.frames, slot, self.frame_slot_size, shape)
+        if copy:
+            # the client reuses the slot a few frames later
+            frame_data = frame_data.copy()
+        return frame_data, bool(flags & FLAG_PASSTHROUGH), scale
+
+    def recv_frame(self, full_resolution=False):
+        # view on the shared memory, valid until the client wraps around the ring
+        frame_data, passthrough, scale = self.recv_shared_frame(copy=False)
+        return self.decode_frame_data(frame_data, passthrough, scale, full_resolution)
+
+    def recv_frame_data(self):
+        return self.recv_shared_frame(copy=True)
+
+    def send_roi(self, roi):
+        # raw frames are not encoded, nothing to save on the client, the detector crops
+        pass
+
+    def send_ready(self):
+        self.connection.send_message(MSG_READY, b"")
+
+    def decode_frame_data(self, frame_data, passthrough, scale=1.0, full_resolution=False):
+        if frame_data.ndim == 1:
+            return decode_frame(frame_data, passthrough, scale, full_resolution)
+        return orient_frame(frame_data, passthrough, scale, full_resolution)
+
     def send_path(self, path):
-        data = pickle.dumps(path, 0)
-        size = len(data)
-        self.conn.sendall(struct.pack(">L", size) + data)
-        # print(size)
\ No newline at end of file
+        points = encode_path(path)[:self.max_path_points]
+        slot = self.path_slot
+        self.path_slot = (self.path_slot + 1) % self.slots
+        slot_array(self.paths, slot, self.path_slot_size, points.shape, path_dtype)[...] = points
+        self.connection.send_message(MSG_SHM_PATH, shm_path.pack(slot, len(points)))
+
+    def close(self):
+        self.conn.close()
+        self.server_socket.close()
+        unlink_shared_memory(self.frames)
+        unlink_shared_memory(self.paths)
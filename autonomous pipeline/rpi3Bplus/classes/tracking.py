@@ -0,0 +1,125 @@
+import cv2
+import numpy as np
+
+from classes.utils_onnx import DetectorWrapper
+
+class KeyframeDetector(DetectorWrapper):
+    # runs the detector only on keyframes (every keyframe_interval frames or when too many
+    # boxes are lost), the boxes are moved along with sparse Lucas-Kanade optical flow on the
+    # frames in between. Same feed_forward output as Yolo
+    def __init__(self, model, keyframe_interval=5, min_tracked=0.7, grid=3, min_points=3,
+                 max_error=1.0, output_size=None):
+        super().__init__(model)
+        self.keyframe_interval = keyframe_interval
+        self.min_tracked = min_tracked # fraction of the boxes that has to be tracked, else keyframe
+        self.grid = grid # grid x grid points tracked per box
+        self.min_points = min_points # points a box needs to be tracked
+        self.max_error = max_error # pixels, forward-backward check of the flow
+        self.output_size = output_size # (width, height) the boxes of model are in, None = frame size
+        self.lk_params = dict(winSize=(15, 15), maxLevel=2,
+                              criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 10, 0.03))
+
+        self.previous_gray = None
+        self.frames_since_keyframe = 0
+        # statistics
+        self.keyframes = 0
+        self.frames = 0
+
+    def box_points(self, boxes):
+        # grid of points inside every box (shrunk a bit, the edges are often background),
+        # returns the points and the box every point belongs to
+        steps = (np.arange(self.grid) + 0.5) / self.grid * 0.6 + 0.2
+        x = boxes[:, 0, np.newaxis] + (boxes[:, 2] - boxes[:, 0])[:, np.newaxis] * steps
+        y = boxes[:, 1, np.newaxis] + (boxes[:, 3] - boxes[:, 1])[:, np.newaxis] * steps
+        points = np.stack([np.repeat(x, self.grid, axis=1), np.tile(y, self.grid)], axis=2)
+        owners = np.repeat(np.arange(len(boxes)), self.grid * self.grid)
+        return points.reshape(-1, 1, 2).astype(np.float32), owners
+
+    def track(self, gray):
+        # returns the moved boxes and which boxes could be tracked
+        boxes = self.frame_boxes
+        points, owners = self.box_points(boxes)
+        new_points, status, error = cv2.calcOpticalFlowPyrLK(self.previous_gray, gray, points, None, **self.lk_params)
+        back_points, back_status, error = cv2.calcOpticalFlowPyrLK(gray, self.previous_gray, new_points, None, **self.lk_params)
+        good = (status.ravel() == 1) & (back_status.ravel() == 1) & \
+               (np.linalg.norm((back_points - points).reshape(-1, 2), axis=1) < self.max_error)
+
+        points = points.reshape(-1, 2)
+        new_points = new_points.reshape(-1, 2)
+        tracked = np.zeros(len(boxes), dtype=bool)
+        new_boxes = boxes.copy()
+        for index in range(len(boxes)):
+            box_good = good & (owners == index)
+            if np.count_nonzero(box_good) < self.min_points:
+                continue
+            tracked[index] = True
+            old = points[box_good]
+            new = new_points[box_good]
+            # median shift and the change of the spread of the points for the scale
+            # (cones get bigger when the car drives towards them)
+            shift = np.median(new - old, axis=0)
+            old_spread = np.linalg.norm(old - old.mean(axis=0), axis=1).mean()
+            new_spread = np.linalg.norm(new - new.mean(axis=0), axis=1).mean()
+            scale = new_spread / old_spread if old_spread > 0 else 1.0
+            centre = (boxes[index, :2] + boxes[index, 2:]) / 2 + shift
+            half_size = (boxes[index, 2:] - boxes[index, :2]) / 2 * scale
+            new_boxes[index] = np.concatenate([centre - half_size, centre + half_size])
+        return new_boxes, tracked
+
+    def frame_offset(self, frame):
+        # frames the client cropped to the region of interest of the model, the boxes
+        # of the model are in full frame pixels
+        roi = getattr(self.model, "roi", None)
+        if roi is not None and frame.shape[:2] == (roi[3] - roi[1], roi[2] - roi[0]):
+            return np.array([roi[0], roi[1]] * 2, dtype=np.float32)
+        return np.zeros(4, dtype=np.float32)
+
+    def to_frame(self, boxes, frame_size, offset):
+        if self.output_size is not None:
+            height, width = frame_size
+            boxes = boxes * np.array([width / self.output_size[0], height / self.output_size[1]] * 2, dtype=np.float32)
+        return boxes - offset
+
+    def from_frame(self, boxes, frame_size, offset):
+        boxes = boxes + offset
+        if self.output_size is not None:
+            height, width = frame_size
+            boxes = boxes * np.array([self.output_size[0] / width, self.output_size[1] / height] * 2, dtype=np.float32)
+        return boxes
+
+    def feed_forward(self, frame):
+        self.frames += 1
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        offset = self.frame_offset(frame)
+        keyframe = self.previous_gray is None or self.frames_since_keyframe + 1 >= self.keyframe_interval \
+                   or len(self.scores) == 0 or gray.shape != self.previous_gray.shape
+
+        if not keyframe:
+            boxes, tracked = self.track(gray)
+            if np.count_nonzero(tracked) < self.min_tracked * len(tracked):
+                # too many boxes lost (fast turn, occlusion), detect again
+                keyframe = True
+            else:
+                self.frame_boxes = boxes[tracked]
+                self.boxes = self.from_frame(self.frame_boxes, gray.shape, offset)
+                self.scores = self.scores[tracked]
+                self.class_ids = self.class_ids[tracked]
+                self.frames_since_keyframe += 1
+
+        if keyframe:
+            boxes, scores, class_ids = self.model.feed_forward(frame)
+            self.keyframes += 1
+            self.frames_since_keyframe = 0
+            if len(scores) == 0:
+                self.boxes, self.scores, self.class_ids = [], [], []
+            else:
+                self.boxes, self.scores, self.class_ids = np.asarray(boxes), np.asarray(scores), np.asarray(class_ids)
+                self.frame_boxes = self.to_frame(self.boxes, gray.shape, offset)
+
+        self.previous_gray = gray
+        return self.boxes, self.scores, self.class_ids
+
+    def get_keyframe_ratio(self):
+        if self.frames == 0:
+            return 0
+        return self.keyframes / self.frames
@@ -61,6 +61,72 @@ def nms(boxes, scores, iou_threshold):
     
     return keep_boxes
 
+def compute_iou_matrix(boxes):
+    # IoU of every box with every other box, (n, n) in one go
+    xmin = np.maximum(boxes[:, np.newaxis, 0], boxes[np.newaxis, :, 0])
+    ymin = np.maximum(boxes[:, np.newaxis, 1], boxes[np.newaxis, :, 1])
+    xmax = np.minimum(boxes[:, np.newaxis, 2], boxes[np.newaxis, :, 2])
+    ymax = np.minimum(boxes[:, np.newaxis, 3], boxes[np.newaxis, :, 3])
+    intersection_area = np.maximum(0, xmax - xmin) * np.maximum(0, ymax - ymin)
+
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    union_area = areas[:, np.newaxis] + areas[np.newaxis, :] - intersection_area
+    return intersection_area / np.maximum(union_area, 1e-9)
+
+def multiclass_nms(boxes, scores, class_ids, iou_threshold, max_detections=None):
+    # class aware non-maxima suppression: only boxes of the same class suppress each other,
+    # so a yellow cone overlapping a blue cone keeps both. Returns indices, highest score first
+    if len(scores) == 0:
+        return np.zeros(0, dtype=int)
+    if hasattr(cv2.dnn, "NMSBoxesBatched"):
+        # opencv >= 4.7, runs in C++
+        xywh_boxes = np.copy(boxes)
+        xywh_boxes[:, 2:] -= boxes[:, :2]
+        indices = cv2.dnn.NMSBoxesBatched(xywh_boxes.tolist(), scores.tolist(), np.asarray(class_ids).tolist(),
+                                          0.0, iou_threshold)
+        indices = np.asarray(indices, dtype=int).reshape(-1)
+        # sort on score, opencv does not guarantee the order over classes
+        indices = indices[np.argsort(scores[indices])[::-1]]
+        return indices if max_detections is None else indices[:max_detections]
+
+    order = np.argsort(scores)[::-1]
+    class_ids = np.asarray(class_ids)[order]
+    # only boxes with a higher score (earlier in order) can suppress a box
+    overlapping = compute_iou_matrix(boxes[order]) > iou_threshold
+    overlapping &= class_ids[:, np.newaxis] == class_ids[np.newaxis, :]
+    overlapping = np.triu(overlapping, k=1)
+
+    suppressed = np.zeros(len(order), dtype=bool)
+    keep = []
+    for index in range(len(order)):
+        if suppressed[index]:
+            continue
+        keep.append(index)
+        if max_detections is not None and len(keep) == max_detections:
+            break
+        suppressed |= overlapping[index]
+    return order[keep]
+
+def match_detections(reference, other, iou_threshold=0.5):
+    # greedy matching of the boxes of other to the reference boxes of the same class,
+    # returns (matched, reference count, other count, ious of the matches)
+    ref_boxes, ref_scores, ref_class_ids = reference
+    boxes, scores, class_ids = other
+    matched = 0
+    ious = []
+    used = np.zeros(len(ref_boxes), dtype=bool)
+    for box, class_id in zip(boxes, class_ids):
+        candidates = np.nonzero((np.asarray(ref_class_ids) == class_id) & ~used)[0]
+        if len(candidates) == 0:
+            continue
+        candidate_ious = compute_iou(box, np.asarray(ref_boxes)[candidates])
+        best = np.argmax(candidate_ious)
+        if candidate_ious[best] >= iou_threshold:
+            used[candidates[best]] = True
+            matched += 1
+            ious.append(candidate_ious[best])
+    return matched, len(ref_boxes), len(boxes), ious
+
 def draw_detections(image, boxes, scores, class_ids, mask_alpha=0.3):
     mask_img = image.copy()
     det_img = image.copy()
@@ -96,4 +162,34 @@ def get_class_name(index):
     return class_names[index]
 
 def get_colors():
-    return colors
\ No newline at end of file
+    return colors
+
+def bottom_centerpoints(boxes):
+    # point of every box (xyxy) the cone stands on, (boxes, 1, 2) as perspectiveTransform takes it
+    centerpoints = np.zeros((len(boxes), 1, 2))
+    for i in range(len(boxes)):
+        centerpoints[i][0][0] = (boxes[i][0] + boxes[i][2]) / 2
+        centerpoints[i][0][1] = np.min([boxes[i][1], boxes[i][3]])
+    return centerpoints
+
+class DetectorWrapper():
+    # base of the detectors that run another detector (TiledYolo, KeyframeDetector, ...), same
+    # interface as Yolo, the detections of the last frame are kept for draw_detections
+    def __init__(self, model):
+        self.model = model
+        self.boxes, self.scores, self.class_ids = [], [], []
+
+    def set_roi(self, roi, cone_band=None):
+        self.model.set_roi(roi, cone_band)
+
+    def draw_detections(self, image, mask_alpha=4):
+        return draw_detections(image, self.boxes, self.scores, self.class_ids, mask_alpha)
+
+    def xyxyBoxes_to_bottom_centerpoints(self, boxes):
+        return bottom_centerpoints(boxes)
+
+    def get_class_name(self, index):
+        return get_class_name(index)
+
+    def get_colors(self):
+        return get_colors()
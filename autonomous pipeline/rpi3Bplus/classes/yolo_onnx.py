@@ -1,42 +1,327 @@
 import numpy as np
 import cv2
+import os
+import json
+import time
+import platform
+from concurrent.futures import ThreadPoolExecutor
 
 import onnxruntime
 
-from classes.utils_onnx import xywh2xyxy, nms, draw_detections, get_class_name, get_colors
+from classes.utils_onnx import xywh2xyxy, multiclass_nms, match_detections, draw_detections, get_class_name, get_colors, \
+    bottom_centerpoints, DetectorWrapper
+
+'''session configuration'''
+# the same code runs on a 4 core raspberry pi and on a many core computer, every setting
+# can be given in session_config, missing ones use these defaults
+default_session_config = {
+    "intra_op_num_threads": 0, # 0 = onnxruntime chooses
+    "inter_op_num_threads": 0,
+    "graph_optimization_level": "all", # disable, basic, extended or all
+    "execution_mode": "sequential", # sequential or parallel
+    "providers": None, # None = all available providers except excluded_providers
+    # save the optimized graph next to the model and load it on the next start instead of
+    # optimizing again
+    "cache_optimized_model": True,
+}
+
+graph_optimization_levels = {
+    "disable": onnxruntime.GraphOptimizationLevel.ORT_DISABLE_ALL,
+    "basic": onnxruntime.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+    "extended": onnxruntime.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+    "all": onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL,
+}
+
+execution_modes = {
+    "sequential": onnxruntime.ExecutionMode.ORT_SEQUENTIAL,
+    "parallel": onnxruntime.ExecutionMode.ORT_PARALLEL,
+}
+
+# providers that do not run the model on this machine (the stock wheel lists
+# AzureExecutionProvider first, it calls a remote endpoint)
+excluded_providers = ["AzureExecutionProvider"]
+
+# frame of a real track the configurations are timed on, an end-to-end model runs its nms on
+# the cones in it
+autotune_image_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "testimages", "20230716-1-small.jpg")
+
+def get_session_config(session_config=None):
+    config = dict(default_session_config)
+    if session_config is not None:
+        config.update(session_config)
+    return config
+
+def available_providers():
+    return [provider for provider in onnxruntime.get_available_providers() if provider not in excluded_providers]
+
+def session_options(config):
+    options = onnxruntime.SessionOptions()
+    options.intra_op_num_threads = config["intra_op_num_threads"]
+    options.inter_op_num_threads = config["inter_op_num_threads"]
+    options.graph_optimization_level = graph_optimization_levels[config["graph_optimization_level"]]
+    options.execution_mode = execution_modes[config["execution_mode"]]
+    return options
+
+def optimized_model_path(path_of_model, graph_optimization_level, providers):
+    # the optimized graph depends on the level and the provider (and is only valid on the
+    # machine that made it, it is not committed)
+    provider = providers[0].replace("ExecutionProvider", "").lower()
+    return path_of_model.replace(".onnx", f"_{graph_optimization_level}_{provider}.optimized.onnx")
+
+def create_session(path_of_model, session_config=None):
+    config = get_session_config(session_config)
+    providers = config["providers"]
+    if providers is None:
+        providers = available_providers()
+    if not config["cache_optimized_model"] or config["graph_optimization_level"] == "disable":
+        return onnxruntime.InferenceSession(path_of_model, sess_options=session_options(config), providers=providers)
+
+    optimized_path = optimized_model_path(path_of_model, config["graph_optimization_level"], providers)
+    if os.path.exists(optimized_path) and os.path.getmtime(optimized_path) >= os.path.getmtime(path_of_model):
+        # optimized on an earlier start, the optimizations do not have to run again
+        options = session_options(config)
+        options.graph_optimization_level = graph_optimization_levels["disable"]
+        try:
+            return onnxruntime.InferenceSession(optimized_path, sess_options=options, providers=providers)
+        except Exception as error:
+            print(f"Optimized model {optimized_path} could not be loaded ({error}), optimizing again")
+
+    options = session_options(config)
+    options.optimized_model_filepath = optimized_path
+    try:
+        return onnxruntime.InferenceSession(path_of_model, sess_options=options, providers=providers)
+    except Exception as error:
+        # providers that compile the graph (TensorRT) can not save it
+        print(f"Optimized model could not be saved ({error})")
+        return onnxruntime.InferenceSession(path_of_model, sess_options=session_options(config), providers=providers)
+
+def candidate_session_configs():
+    cores = os.cpu_count() or 1
+    thread_counts = sorted({1, max(1, cores // 2), cores})
+    # every accelerator on its own (with the cpu as fallback) and the cpu alone
+    provider_lists = [[provider, "CPUExecutionProvider"] for provider in available_providers()
+                      if provider != "CPUExecutionProvider"]
+    provider_lists.append(["CPUExecutionProvider"])
+
+    candidates = []
+    for providers in provider_lists:
+        for threads in thread_counts:
+            candidates.append({"intra_op_num_threads": threads, "execution_mode": "sequential",
+                               "providers": providers})
+        # parallel only helps graphs with independent branches, try it once with all cores
+        candidates.append({"intra_op_num_threads": cores, "inter_op_num_threads": 2,
+                           "execution_mode": "parallel", "providers": providers})
+    return [get_session_config(candidate) for candidate in candidates]
+
+def time_session(session, inputs, runs):
+    # first run is slower (memory allocation), not counted
+    session.run(None, inputs)
+    times = []
+    for i in range(runs):
+        t0 = time.perf_counter()
+        session.run(None, inputs)
+        times.append(time.perf_counter() - t0)
+    return float(np.median(times))
+
+def autotune_session(path_of_model, inputs, runs=5, use_cache=True):
+    # times the candidate configurations and returns the fastest one, the result is cached
+    # next to the model per machine so this only runs once
+    cache_path = path_of_model + ".session.json"
+    machine = "{}-{}-{}cores-ort{}".format(platform.node(), platform.machine(), os.cpu_count(), onnxruntime.__version__)
+    model_stat = os.stat(path_of_model)
+    model_key = "{}-{}".format(model_stat.st_size, int(model_stat.st_mtime))
+
+    cache = {}
+    if os.path.exists(cache_path):
+        with open(cache_path) as cache_file:
+            cache = json.load(cache_file)
+    if use_cache and machine in cache and cache[machine]["model"] == model_key:
+        return cache[machine]["config"]
+
+    best_config = None
+    best_time = None
+    for config in candidate_session_configs():
+        try:
+            session = create_session(path_of_model, config)
+            run_time = time_session(session, inputs, runs)
+        except Exception as error:
+            print(f"Session config {config} failed: {error}")
+            continue
+        print(f"{config['providers'][0]}\t{config['execution_mode']}\t{config['intra_op_num_threads']} threads\t{run_time*1000:.2f} ms")
+        if best_time is None or run_time < best_time:
+            best_config = config
+            best_time = run_time
+    if best_config is None:
+        return get_session_config()
+
+    cache[machine] = {"model": model_key, "config": best_config, "time_ms": best_time*1000}
+    with open(cache_path, "w") as cache_file:
+        json.dump(cache, cache_file, indent=4)
+    return best_config
+
+def graph_input_size(path_of_model):
+    # (height, width) of the graph input, models exported with a dynamic input size
+    # have names there and the size of the export in the ultralytics metadata
+    session = onnxruntime.InferenceSession(path_of_model, providers=["CPUExecutionProvider"])
+    height, width = session.get_inputs()[0].shape[2:]
+    if not isinstance(height, int) or not isinstance(width, int):
+        imgsz = session.get_modelmeta().custom_metadata_map.get("imgsz", "[640, 640]")
+        height, width = json.loads(imgsz)
+    return height, width
+
+def filter_cone_band(boxes, scores, class_ids, cone_band):
+    # height of the box has to fit the distance of its ground point (same point as
+    # xyxyBoxes_to_bottom_centerpoints), cone_band from Homography.calculateConeBand
+    if cone_band is None or len(scores) == 0:
+        return boxes, scores, class_ids
+    min_heights, max_heights = cone_band
+    rows = np.clip(np.minimum(boxes[:, 1], boxes[:, 3]).astype(int), 0, len(min_heights) - 1)
+    heights = np.abs(boxes[:, 3] - boxes[:, 1])
+    keep = (heights >= min_heights[rows]) & (heights <= max_heights[rows])
+    if not np.any(keep):
+        return [], [], []
+    return boxes[keep], scores[keep], class_ids[keep]
+
+def quantized_model_path(path_of_model):
+    # INT8 copy made by quantize_yolo.py
+    return path_of_model.replace(".onnx", "_int8.onnx")
+
+def resolution_model_path(path_of_model, size):
+    # copy of the model exported at another input size, e.g. YOLOv8n_FSOCO_320.onnx
+    return path_of_model.replace(".onnx", f"_{size}.onnx")
+
+def end_to_end_model_path(path_of_model):
+    # model with preprocessing and nms in the graph, made by export_yolo_e2e.py
+    return path_of_model.replace(".onnx", "_e2e.onnx")
 
 class Yolo:
-    def __init__(self, path_of_model, conf_thres=0.5, iou_thres=0.5):
+    def __init__(self, path_of_model, conf_thres=0.5, iou_thres=0.5, max_detections=100, session_config=None, autotune=False, autotune_frame=None,
+                 quantized=False, end_to_end=False):
         # thresholds
         self.conf_threshold = conf_thres
         self.iou_threshold = iou_thres
+        self.max_detections = max_detections # top-k after nms
+        # region of interest and per row cone size band, see set_roi
+        self.roi = None
+        self.cone_band = None
+        # INT8 model has the same inputs and outputs, only the path changes
+        if quantized:
+            if os.path.exists(quantized_model_path(path_of_model)):
+                path_of_model = quantized_model_path(path_of_model)
+            else:
+                print(f"No quantized model found, run quantize_yolo.py first. Using {path_of_model}")
+        # end-to-end model takes the uint8 BGR frame and returns the final boxes
+        if end_to_end:
+            if os.path.exists(end_to_end_model_path(path_of_model)):
+                path_of_model = end_to_end_model_path(path_of_model)
+            else:
+                print(f"No end-to-end model found, run export_yolo_e2e.py first. Using {path_of_model}")
+                end_to_end = False
+        self.end_to_end = end_to_end
+        self.path_of_model = path_of_model
         # onnx model
-        self.session = onnxruntime.InferenceSession(path_of_model)
+        self.load_model(path_of_model, session_config)
+        self.allocate_buffers()
+
+        if autotune:
+            self.autotune(path_of_model, autotune_frame)
+
+    def allocate_buffers(self):
+        # preprocessing buffers, allocated once and reused for every frame
+        self.resized_frame = np.empty((self.input_height, self.input_width, 3), dtype=np.uint8)
+        self.input_tensor = np.empty((1, 3, self.input_height, self.input_width), dtype=np.float32)
+
+    def load_model(self, path_of_model, session_config=None):
+        self.session_config = get_session_config(session_config)
+        self.session = create_session(path_of_model, self.session_config)
         self.get_input_details()
         self.get_output_details()
 
+    def run_network(self, input_tensor):
+        # (batch, 3, height, width) float32 in, list of outputs out
+        return self.session.run(self.output_names, {self.input_names[0]: input_tensor})
+
+    def warmup(self, runs=1):
+        # the first runs allocate the memory of the session, done before the first frame comes
+        frame = np.zeros((self.input_height, self.input_width, 3), dtype=np.uint8)
+        for i in range(runs):
+            self.detect(frame)
+
+    def autotune(self, path_of_model, frame=None):
+        # picks the fastest session configuration for this machine and model (cached)
+        if frame is None:
+            frame = cv2.imread(autotune_image_path)
+        if frame is None:
+            # test images not copied, the network takes as long on noise (only the nms of
+            # an end-to-end model depends on the content)
+            frame = np.random.randint(0, 256, (self.input_height, self.input_width, 3), dtype=np.uint8)
+        self.session_config = autotune_session(path_of_model, self.get_inputs(frame))
+        self.session = create_session(path_of_model, self.session_config)
+        print(f"Session config: {self.session_config}")
+
     def get_input_details(self):
         model_inputs = self.session.get_inputs()
         self.input_names = [model_inputs[i].name for i in range(len(model_inputs))]
         self.input_shape = model_inputs[0].shape
+        if self.end_to_end:
+            # input is a frame of any size, the size the network runs at is in the metadata
+            input_size = self.session.get_modelmeta().custom_metadata_map["input_size"]
+            self.input_height, self.input_width = [int(size) for size in input_size.split(",")]
+            self.dynamic_batch = False
+            self.dynamic_size = False
+            return
         self.input_height = self.input_shape[2]
         self.input_width = self.input_shape[3]
+        # height and width are names for models exported with a dynamic input size, they run at
+        # the size of the export (ultralytics metadata) until set_input_size is called
+        self.dynamic_size = not isinstance(self.input_height, int) or not isinstance(self.input_width, int)
+        if self.dynamic_size:
+            imgsz = self.session.get_modelmeta().custom_metadata_map.get("imgsz", "[640, 640]")
+            self.input_height, self.input_width = json.loads(imgsz)
+        # batch axis is a name (e.g. "batch") for models exported with a dynamic batch size
+        self.dynamic_batch = not isinstance(self.input_shape[0], int) or self.input_shape[0] != 1
     
+    def set_input_size(self, height, width):
+        # only for models with a dynamic input size, multiples of 32 (stride of YOLOv8)
+        if not self.dynamic_size:
+            raise ValueError(f"{self.path_of_model} has a fixed input size of {self.input_height}x{self.input_width}")
+        if (height, width) != (self.input_height, self.input_width):
+            self.input_height, self.input_width = height, width
+            self.allocate_buffers()
+
     def get_output_details(self):
         model_outputs = self.session.get_outputs()
         self.output_names = [model_outputs[i].name for i in range(len(model_outputs))]
 
+    def prepare_frame(self, frame, resized_frame, input_tensor):
+        # resize first, the color conversion then only touches the smaller image
+        cv2.resize(frame, (self.input_width, self.input_height), dst=resized_frame)
+        # BGR to RGB, HWC to CHW and scaling to 0 to 1 in one pass per channel,
+        # written straight into the float32 input tensor
+        for channel in range(3):
+            np.multiply(resized_frame[:, :, 2 - channel], 1 / 255.0,
+                        out=input_tensor[channel], dtype=np.float32)
+
+    def get_inputs(self, frame):
+        if self.end_to_end:
+            # frame goes in as it is, (1, height, width, 3) uint8 BGR
+            return {self.input_names[0]: np.ascontiguousarray(frame)[np.newaxis],
+                    "score_threshold": np.array([self.conf_threshold], dtype=np.float32),
+                    "iou_threshold": np.array([self.iou_threshold], dtype=np.float32),
+                    "max_detections": np.array([self.max_detections], dtype=np.int64)}
+        return {self.input_names[0]: self.preprocess_input(frame).copy()}
+
     def preprocess_input(self, frame):
         self.img_height, self.img_width = frame.shape[:2]
-        
-        input_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        self.prepare_frame(frame, self.resized_frame, self.input_tensor[0])
+        return self.input_tensor
 
-        input_frame = cv2.resize(input_frame, (self.input_width, self.input_height))
-        # Scale input pixel values to 0 to 1
-        input_frame = input_frame / 255.0
-        input_frame = input_frame.transpose(2, 0, 1)
-        input_tensor = input_frame[np.newaxis, :, :, :].astype(np.float32)
-        
+    def preprocess_batch(self, frames):
+        # own buffers, the ones of preprocess_input can be in use by feed_forward
+        resized_frame = np.empty_like(self.resized_frame)
+        input_tensor = np.empty((len(frames), 3, self.input_height, self.input_width), dtype=np.float32)
+        for index, frame in enumerate(frames):
+            self.prepare_frame(frame, resized_frame, input_tensor[index])
         return input_tensor
     
     def rescale_boxes(self, boxes):
@@ -55,48 +340,531 @@ class Yolo:
         return boxes
     
     def process_output(self, outputs):
-        predictions = np.squeeze(outputs[0]).T
+        # (4 + classes, anchors), thresholded in this layout so only the
+        # predictions above the threshold are copied
+        output = outputs[0][0]
         
 		# Filter out object confidence scores below threshold
-        scores = np.max(predictions[:, 4:], axis=1)
-        predictions = predictions[scores > self.conf_threshold, :]
-        scores = scores[scores > self.conf_threshold]
+        scores = np.max(output[4:], axis=0)
+        keep = np.nonzero(scores > self.conf_threshold)[0]
         
-        if len(scores) == 0:
+        if len(keep) == 0:
             return [], [], []
+        scores = scores[keep]
         
 		# Get the class with the highest confidence
-        class_ids = np.argmax(predictions[:, 4:], axis=1)
+        class_ids = np.argmax(output[4:, keep], axis=0)
         
 		# Get bounding boxes for each object
-        boxes = self.extract_boxes(predictions)
+        boxes = self.extract_boxes(output[:4, keep].T)
         
-		# Apply non-maxima suppression to suppress weak, overlapping bounding boxes
-        indices = nms(boxes, scores, self.iou_threshold)
+		# Apply class aware non-maxima suppression to suppress weak, overlapping bounding boxes
+        indices = multiclass_nms(boxes, scores, class_ids, self.iou_threshold, self.max_detections)
         return boxes[indices], scores[indices], class_ids[indices]
     
-    def feed_forward(self, frame):
+    def process_output_batch(self, output, image_sizes):
+        # output (batch, 4 + classes, anchors), thresholded for all frames at once
+        # without transposing the whole output
+        scores = np.max(output[:, 4:, :], axis=1)
+        frame_indices, anchor_indices = np.nonzero(scores > self.conf_threshold)
+        results = [([], [], []) for i in range(len(image_sizes))]
+        if len(frame_indices) == 0:
+            return results
+
+        scores = scores[frame_indices, anchor_indices]
+        # (detections, classes) and (detections, 4)
+        class_ids = np.argmax(output[frame_indices, 4:, anchor_indices], axis=1)
+        boxes = output[frame_indices, :4, anchor_indices]
+
+        # rescale every box to the size of its own frame, then to xyxy
+        image_sizes = np.array(image_sizes, dtype=np.float32) # (height, width) per frame
+        scale = image_sizes[frame_indices][:, ::-1] / np.array([self.input_width, self.input_height], dtype=np.float32)
+        boxes = xywh2xyxy(boxes * np.tile(scale, 2))
+
+        # one class aware nms for the whole batch, every (frame, class) is its own group
+        groups = frame_indices * (output.shape[1] - 4) + class_ids
+        indices = multiclass_nms(boxes, scores, groups, self.iou_threshold)
+
+        for frame_index in range(len(image_sizes)):
+            keep = indices[frame_indices[indices] == frame_index][:self.max_detections]
+            if len(keep) > 0:
+                results[frame_index] = (boxes[keep], scores[keep], class_ids[keep])
+        return results
+
+    def run_end_to_end(self, frame):
+        # single call, boxes (xyxy in frame pixels), scores and class ids come out of the graph
+        boxes, scores, class_ids = self.session.run(self.output_names, self.get_inputs(frame))
+        if len(scores) == 0:
+            return [], [], []
+        return boxes, scores, class_ids
+
+    def set_roi(self, roi, cone_band=None):
+        # roi (x0, y0, x1, y1) and cone_band (min heights, max heights per row) in full frame
+        # pixels from Homography.calculateRoi and calculateConeBand, None = not used
+        self.roi = roi
+        self.cone_band = cone_band
+
+    def crop_to_roi(self, frame):
+        # returns the part of the frame YOLO runs on and its offset in the full frame
+        if self.roi is None:
+            return frame, (0, 0)
+        x0, y0, x1, y1 = self.roi
+        if frame.shape[:2] == (y1 - y0, x1 - x0):
+            # client sent the region of interest only
+            return frame, (x0, y0)
+        return frame[y0:y1, x0:x1], (x0, y0)
+
+    def to_full_frame(self, detections, offset):
+        boxes, scores, class_ids = detections
+        if len(scores) == 0:
+            return [], [], []
+        if offset != (0, 0):
+            boxes = boxes + np.array([offset[0], offset[1], offset[0], offset[1]], dtype=np.float32)
+        return filter_cone_band(boxes, scores, class_ids, self.cone_band)
+
+    def detect(self, frame):
+        if self.end_to_end:
+            return self.run_end_to_end(frame)
+
         input_tensor = self.preprocess_input(frame)
         
 		# Run inference model
-        outputs = self.session.run(self.output_names, {self.input_names[0]: input_tensor})
-        
-        self.boxes, self.scores, self.class_ids = self.process_output(outputs)
+        outputs = self.run_network(input_tensor)
         
+        return self.process_output(outputs)
+
+    def feed_forward(self, frame):
+        frame, offset = self.crop_to_roi(frame)
+        self.boxes, self.scores, self.class_ids = self.to_full_frame(self.detect(frame), offset)
         return self.boxes, self.scores, self.class_ids
+
+    def feed_forward_batch(self, frames):
+        # returns [(boxes, scores, class_ids), ...] with one entry per frame,
+        # nothing is kept on the instance so it can be called from several threads
+        if len(frames) == 0:
+            return []
+        crops = [self.crop_to_roi(frame) for frame in frames]
+        results = self.detect_batch([frame for frame, offset in crops])
+        return [self.to_full_frame(result, offset) for result, (frame, offset) in zip(results, crops)]
+
+    def detect_batch(self, frames):
+        if self.end_to_end:
+            # exported with a batch size of 1
+            return [self.run_end_to_end(frame) for frame in frames]
+        input_tensor = self.preprocess_batch(frames)
+
+        if self.dynamic_batch:
+            output = self.run_network(input_tensor)[0]
+        else:
+            # model exported with a batch size of 1, only the post-processing is batched
+            output = np.concatenate([self.run_network(input_tensor[index:index+1])[0]
+                                     for index in range(len(frames))])
+
+        return self.process_output_batch(output, [frame.shape[:2] for frame in frames])
     
     def draw_detections(self, image, mask_alpha=4):
         return draw_detections(image, self.boxes, self.scores, self.class_ids, mask_alpha)
     
     def xyxyBoxes_to_bottom_centerpoints(self, boxes):
-        centerpoints = np.zeros((len(boxes), 1, 2))
-        for i in range(len(boxes)):
-            centerpoints[i][0][0] = (boxes[i][0] + boxes[i][2]) / 2
-            centerpoints[i][0][1] = np.min([boxes[i][1], boxes[i][3]])
-        return centerpoints
+        return bottom_centerpoints(boxes)
     
     def get_class_name(self, index):
         return get_class_name(index)
     
     def get_colors(self):
-        return get_colors()
\ No newline at end of file
+        return get_colors()
+
+class OpenCVYolo(Yolo):
+    # same pre- and post-processing as Yolo, the network runs in cv2.dnn which is
+    # often faster than onnxruntime on ARM. cv2.dnn can not tell the input size of the model,
+    # it is read with onnxruntime unless input_size (height, width) is given
+    def __init__(self, path_of_model, conf_thres=0.5, iou_thres=0.5, max_detections=100, input_size=None):
+        self.input_size = input_size
+        super().__init__(path_of_model, conf_thres, iou_thres, max_detections)
+
+    def load_model(self, path_of_model, session_config=None):
+        self.net = cv2.dnn.readNetFromONNX(path_of_model)
+        self.input_names = ["images"]
+        if self.input_size is None:
+            try:
+                self.input_size = graph_input_size(path_of_model)
+            except Exception as error:
+                print(f"Could not read the input size of {path_of_model} ({error}), using 640x640")
+                self.input_size = (640, 640)
+        self.input_height, self.input_width = self.input_size
+        self.dynamic_batch = False
+        self.dynamic_size = False
+
+    def run_network(self, input_tensor):
+        self.net.setInput(input_tensor)
+        return [self.net.forward()]
+
+class UltralyticsYolo(Yolo):
+    # the .pt model through ultralytics, which does its own pre- and post-processing
+    def __init__(self, path_of_model, conf_thres=0.5, iou_thres=0.5, max_detections=100):
+        super().__init__(path_of_model, conf_thres, iou_thres, max_detections)
+
+    def load_model(self, path_of_model, session_config=None):
+        from ultralytics import YOLO # only needed for this backend, not installed on the raspberry pi
+        self.model = YOLO(path_of_model)
+        self.input_names = ["images"]
+        self.input_height = self.input_width = 640
+        self.dynamic_batch = True
+        self.dynamic_size = False
+
+    def run_model(self, frames):
+        # class aware nms (agnostic_nms=False) like Yolo
+        results = self.model(frames, conf=self.conf_threshold, iou=self.iou_threshold, max_det=self.max_detections, verbose=False)
+        detections = []
+        for result in results:
+            if len(result.boxes) == 0:
+                detections.append(([], [], []))
+            else:
+                detections.append((result.boxes.xyxy.cpu().numpy(), result.boxes.conf.cpu().numpy(),
+                                   result.boxes.cls.cpu().numpy().astype(int)))
+        return detections
+
+    def detect(self, frame):
+        return self.run_model(frame)[0]
+
+    def detect_batch(self, frames):
+        return self.run_model(list(frames))
+
+'''tiled inference'''
+# far cones are only a few pixels in the 448x448 frame, on the full resolution frame of the
+# camera cut in overlapping tiles every tile is enlarged to the input size of the network
+def tile_starts(start, end, size, overlap):
+    # evenly spread tile starts from start to end with at least overlap (fraction) overlap
+    if end - start <= size:
+        return [start]
+    step = size * (1 - overlap)
+    count = int(np.ceil((end - start - size) / step)) + 1
+    return [int(round(start + index * (end - start - size) / (count - 1))) for index in range(count)]
+
+def tile_grid(frame_size, tile_size, overlap, band=None):
+    # tiles (x0, y0, x1, y1) covering the frame, or only the rows of band (y0, y1)
+    height, width = frame_size
+    top, bottom = band if band is not None else (0, height)
+    tile_height = min(tile_size[0], bottom - top)
+    tile_width = min(tile_size[1], width)
+    return [(x, y, x + tile_width, y + tile_height)
+            for y in tile_starts(top, bottom, tile_height, overlap)
+            for x in tile_starts(0, width, tile_width, overlap)]
+
+def tile_workers(model):
+    # every session run already uses intra_op_num_threads cores, more threads than
+    # cores / intra_op_num_threads only oversubscribe the cpu
+    if model.dynamic_batch or not hasattr(model, "session"):
+        return 1
+    threads = model.session_config["intra_op_num_threads"]
+    if threads <= 0:
+        # 0 = onnxruntime uses all cores
+        return 1
+    return max(1, (os.cpu_count() or 1) // threads)
+
+class TiledYolo(DetectorWrapper):
+    # runs a detector (Yolo or one of the other backends) on overlapping tiles of a full
+    # resolution frame as a batch and merges the detections, boxes are returned in pixels of
+    # output_size (the frame size the homography is calculated on)
+    def __init__(self, model, tile_size=(320, 320), overlap=0.25, band=None, full_frame=True,
+                 output_size=None, workers=None):
+        super().__init__(model)
+        self.tile_size = tile_size # (height, width)
+        self.overlap = overlap # fraction of the tile size
+        self.band = band # (y0, y1) rows of the full resolution frame to tile (far band), None = all
+        # the whole frame is run as well for the near cones that are bigger than the overlap
+        self.full_frame = full_frame
+        self.output_size = output_size # (width, height), None = size of the frame
+        self.roi = None
+        self.cone_band = None
+        # models with a batch axis run all tiles in one call, others can split them over threads
+        if workers is None:
+            workers = tile_workers(model)
+        if not hasattr(model, "session"):
+            # cv2.dnn nets (and the ultralytics model) are not thread safe
+            workers = 1
+        self.workers = workers
+        self.executor = ThreadPoolExecutor(max_workers=workers) if workers > 1 else None
+
+    def set_roi(self, roi, cone_band=None):
+        # roi in pixels of output_size, only its rows are tiled
+        self.roi = roi
+        self.cone_band = cone_band
+
+    def get_tiles(self, frame_size):
+        band = self.band
+        if self.roi is not None:
+            height = frame_size[0]
+            output_height = self.output_size[1] if self.output_size is not None else height
+            band = (int(self.roi[1] * height / output_height), int(self.roi[3] * height / output_height))
+        tiles = tile_grid(frame_size, self.tile_size, self.overlap, band)
+        if self.full_frame:
+            tiles.append((0, 0, frame_size[1], frame_size[0]))
+        return tiles
+
+    def detect_tiles(self, crops):
+        if self.executor is None or len(crops) == 1:
+            return self.model.detect_batch(crops)
+        # detect_batch has its own buffers, so chunks can run at the same time
+        chunks = [crops[index::self.workers] for index in range(self.workers)]
+        chunk_results = list(self.executor.map(self.model.detect_batch, [chunk for chunk in chunks if len(chunk) > 0]))
+        results = [None] * len(crops)
+        for index, chunk_result in enumerate(chunk_results):
+            results[index::self.workers] = chunk_result
+        return results
+
+    def feed_forward(self, frame):
+        height, width = frame.shape[:2]
+        tiles = self.get_tiles((height, width))
+        results = self.detect_tiles([frame[y0:y1, x0:x1] for x0, y0, x1, y1 in tiles])
+
+        all_boxes = []
+        all_scores = []
+        all_class_ids = []
+        for (x0, y0, x1, y1), (boxes, scores, class_ids) in zip(tiles, results):
+            if len(scores) == 0:
+                continue
+            boxes = boxes + np.array([x0, y0, x0, y0], dtype=np.float32)
+            # a cone cut by the inner edge of a tile is complete in the neighbouring tile
+            inner_edges = np.array([x0 > 0, y0 > 0, x1 < width, y1 < height])
+            if np.any(inner_edges):
+                edges = np.array([x0, y0, x1, y1], dtype=np.float32)
+                touching = (np.abs(boxes - edges) < 2) & inner_edges
+                keep = ~np.any(touching, axis=1)
+                boxes, scores, class_ids = boxes[keep], scores[keep], class_ids[keep]
+            all_boxes.append(boxes)
+            all_scores.append(scores)
+            all_class_ids.append(class_ids)
+
+        self.boxes, self.scores, self.class_ids = [], [], []
+        if len(all_scores) > 0 and sum(len(scores) for scores in all_scores) > 0:
+            boxes = np.concatenate(all_boxes)
+            scores = np.concatenate(all_scores)
+            class_ids = np.concatenate(all_class_ids)
+            # the same cone found in several tiles (and the whole frame)
+            indices = multiclass_nms(boxes, scores, class_ids, self.model.iou_threshold, self.model.max_detections)
+            boxes = boxes[indices]
+            if self.output_size is not None:
+                boxes = boxes * np.array([self.output_size[0] / width, self.output_size[1] / height] * 2, dtype=np.float32)
+            self.boxes, self.scores, self.class_ids = filter_cone_band(boxes, scores[indices], class_ids[indices], self.cone_band)
+        return self.boxes, self.scores, self.class_ids
+
+    def feed_forward_batch(self, frames):
+        return [self.feed_forward(frame) for frame in frames]
+
+'''split computing'''
+# the pi only sends crops around its HSV cone proposals (Client.encode_crops_data), the
+# detector here decides which crops hold a cone
+class CropYolo(DetectorWrapper):
+    # runs a detector (Yolo or one of the other backends) on the crops of one frame in batches
+    # of max_batch_size, boxes are returned in pixels of the frame the crops were cut from
+    # (or of output_size)
+    def __init__(self, model, max_batch_size=8, output_size=None):
+        super().__init__(model)
+        self.max_batch_size = max_batch_size
+        self.output_size = output_size # (width, height), None = size of the frame
+        self.cone_band = None
+        # statistics
+        self.frames = 0
+        self.crops = 0
+
+    def set_roi(self, roi, cone_band=None):
+        # the client drops the crops outside the roi, only the cone band is left to check
+        self.cone_band = cone_band
+
+    def feed_forward(self, crops):
+        # crops = (crops, offsets, frame size) of ServerConnection.recv_crops
+        crops, offsets, (width, height) = crops
+        self.frames += 1
+        self.crops += len(crops)
+        self.boxes, self.scores, self.class_ids = [], [], []
+        if len(crops) == 0:
+            return self.boxes, self.scores, self.class_ids
+
+        results = []
+        for index in range(0, len(crops), self.max_batch_size):
+            results += self.model.detect_batch(crops[index:index + self.max_batch_size])
+
+        all_boxes = []
+        all_scores = []
+        all_class_ids = []
+        for (x0, y0), (boxes, scores, class_ids) in zip(offsets, results):
+            if len(scores) == 0:
+                continue
+            all_boxes.append(boxes + np.array([x0, y0, x0, y0], dtype=np.float32))
+            all_scores.append(scores)
+            all_class_ids.append(class_ids)
+        if len(all_scores) == 0:
+            return self.boxes, self.scores, self.class_ids
+
+        boxes = np.concatenate(all_boxes)
+        scores = np.concatenate(all_scores)
+        class_ids = np.concatenate(all_class_ids)
+        # crops of neighbouring proposals overlap, the same cone can be in several of them
+        indices = multiclass_nms(boxes, scores, class_ids, self.model.iou_threshold, self.model.max_detections)
+        boxes = boxes[indices]
+        if self.output_size is not None:
+            boxes = boxes * np.array([self.output_size[0] / width, self.output_size[1] / height] * 2, dtype=np.float32)
+        self.boxes, self.scores, self.class_ids = filter_cone_band(boxes, scores[indices], class_ids[indices], self.cone_band)
+        return self.boxes, self.scores, self.class_ids
+
+    def get_average_crops(self):
+        if self.frames == 0:
+            return 0
+        return self.crops / self.frames
+
+'''adaptive resolution'''
+class AdaptiveResolution():
+    # picks the input size of the detector for the next frame. The biggest size is only used
+    # when the far cones matter (few cones found), the smallest when the car is slow.
+    # A size whose inference time does not fit in the budget is never used
+    def __init__(self, sizes=(448, 320, 256), budget=0.05, far_cones=6, slow_speed=5, smoothing=0.3, cooldown=5):
+        self.sizes = sorted(sizes, reverse=True)
+        self.budget = budget # seconds of inference per frame
+        self.far_cones = far_cones # fewer cones found than this: far cones are needed
+        self.slow_speed = slow_speed # at this speed or slower the near cones are enough
+        self.smoothing = smoothing # weight of a new measurement in the moving average
+        self.cooldown = cooldown # frames to wait after a change before the next one
+        self.times = [None] * len(self.sizes) # average inference time per size
+        self.level = 0
+        self.size = self.sizes[self.level]
+        self.frames_since_change = 0
+        # statistics
+        self.frames_per_size = {size: 0 for size in self.sizes}
+
+    def estimate_time(self, level):
+        # sizes not run yet are scaled from a measured size by the number of pixels
+        if self.times[level] is not None:
+            return self.times[level]
+        for size, size_time in zip(self.sizes, self.times):
+            if size_time is not None:
+                return size_time * (self.sizes[level] / size) ** 2
+        return 0
+
+    def wanted_level(self, cones, speed):
+        # cones first: the car also brakes because too few cones are found, a smaller size
+        # would find even fewer far cones and keep it braking
+        if cones < self.far_cones:
+            # only a few cones found, they are far away or the track turns
+            return 0
+        if speed is not None and speed <= self.slow_speed:
+            return len(self.sizes) - 1
+        return len(self.sizes) // 2
+
+    def update(self, frame_time, cones, speed=None):
+        self.frames_per_size[self.size] += 1
+        if self.times[self.level] is None:
+            self.times[self.level] = frame_time
+        else:
+            self.times[self.level] += self.smoothing * (frame_time - self.times[self.level])
+
+        self.frames_since_change += 1
+        if self.frames_since_change < self.cooldown:
+            return
+        # the budget decides how big the wanted size can be
+        level = self.wanted_level(cones, speed)
+        while level + 1 < len(self.sizes) and self.estimate_time(level) > self.budget:
+            level += 1
+        self.set_level(level)
+
+    def set_level(self, level):
+        if level != self.level:
+            self.level = level
+            self.size = self.sizes[self.level]
+            self.frames_since_change = 0
+
+    def get_state(self):
+        return self.size, self.times[self.level]
+
+class MultiResolutionYolo(DetectorWrapper):
+    # runs every frame at the input size of AdaptiveResolution, with one model exported with a
+    # dynamic input size or with one model per size (resolution_model_path)
+    def __init__(self, path_of_model, sizes=(448, 320, 256), budget=0.05, **kwargs):
+        model = Yolo(path_of_model, **kwargs)
+        super().__init__(model)
+        if model.dynamic_size:
+            self.models = {size: model for size in sizes}
+        else:
+            self.models = {model.input_height: model}
+            for size in sizes:
+                if size in self.models:
+                    continue
+                path = resolution_model_path(path_of_model, size)
+                if os.path.exists(path):
+                    self.models[size] = Yolo(path, **kwargs)
+                else:
+                    print(f"No model with input size {size} found ({path})")
+        self.governor = AdaptiveResolution(list(self.models), budget)
+        self.speed = None
+
+    def warmup(self, runs=1):
+        # a dynamic model allocates again for every new input size
+        for size, model in self.models.items():
+            if model.dynamic_size:
+                model.set_input_size(size, size)
+            model.warmup(runs)
+
+    def set_speed(self, speed):
+        # speed the car drives at, None = unknown
+        self.speed = speed
+
+    def set_roi(self, roi, cone_band=None):
+        for model in self.models.values():
+            model.set_roi(roi, cone_band)
+
+    def feed_forward(self, frame):
+        size = self.governor.size
+        model = self.models[size]
+        if model.dynamic_size:
+            model.set_input_size(size, size)
+        t0 = time.perf_counter()
+        self.boxes, self.scores, self.class_ids = model.feed_forward(frame)
+        self.governor.update(time.perf_counter() - t0, len(self.scores), self.speed)
+        return self.boxes, self.scores, self.class_ids
+
+'''backends'''
+# every backend takes a BGR frame and returns (boxes (xyxy), scores, class_ids) as arrays
+backends = {
+    "onnxruntime": Yolo,
+    "opencv": OpenCVYolo,
+    "ultralytics": UltralyticsYolo,
+}
+
+def create_detector(backend, path_of_model, **kwargs):
+    if backend not in backends:
+        raise ValueError(f"Unknown backend {backend}, choose from {list(backends)}")
+    return backends[backend](path_of_model, **kwargs)
+
+def compare_detectors(detectors, frames, iou_threshold=0.5):
+    # runs every detector on the same frames and prints the latency and how many detections
+    # agree with the first detector
+    results = {}
+    times = {}
+    for name, detector in detectors.items():
+        # first frame is slower (memory allocation), not counted
+        detector.feed_forward(frames[0])
+        frame_times = []
+        results[name] = []
+        for frame in frames:
+            t0 = time.perf_counter()
+            results[name].append(detector.feed_forward(frame))
+            frame_times.append(time.perf_counter() - t0)
+        times[name] = float(np.median(frame_times))
+
+    reference = list(detectors)[0]
+    print(f"Backend\t\tLatency (median)\tCones\tAgreement with {reference} (F1)\tMean IoU")
+    for name in detectors:
+        matched = 0
+        count = 0
+        reference_count = 0
+        ious = []
+        for reference_result, result in zip(results[reference], results[name]):
+            frame_matched, frame_reference, frame_count, frame_ious = match_detections(reference_result, result, iou_threshold)
+            matched += frame_matched
+            reference_count += frame_reference
+            count += frame_count
+            ious += frame_ious
+        agreement = 2 * matched / (reference_count + count) * 100 if reference_count + count > 0 else 100.0
+        mean_iou = np.mean(ious) if len(ious) > 0 else 0.0
+        print(f"{name}\t{times[name]*1000:.2f} ms\t\t{count}\t{agreement:.1f} %\t\t\t{mean_iou:.3f}")
+    return results, times
@@ -1,25 +1,34 @@
 import cv2
 import numpy as np
-import matplotlib.pyplot as plt
 import time
 
 from classes.camera import Camera
 from classes.yolo_onnx import Yolo
 from classes.homography import Homography
+from classes.tracking import KeyframeDetector
 
 # print timestamps
 timestamps = True
+# time a few onnxruntime session configurations at startup and use the fastest (cached)
+autotune = False
+# use the INT8 model made by quantize_yolo.py (faster on the raspberry pi)
+quantized = False
+# run YOLO every n frames (or when boxes get lost), optical flow moves the boxes in between (1 = every frame)
+keyframe_interval = 1
 # showimages
 showprocess = True
 floorplan = False
 cameraview = True
 cone_measuring_output = False
+# show the frame the homography mask is calculated on
+showmaskframe = False
 
 if cone_measuring_output:
     import xlsxwriter
     workbook = xlsxwriter.Workbook("testdata.xlsx")
 
-if floorplan:
+# matplotlib takes seconds to import on the raspberry pi, only when plotting
+if floorplan or showmaskframe:
     import matplotlib.pyplot as plt
 
 '''functions'''
@@ -48,7 +57,11 @@ camera = Camera(fps)
 print("Camera initialised!")
 
 onnx_path = "data/YOLOv8n_FSOCO.onnx"
-model = Yolo(onnx_path)
+model = Yolo(onnx_path, autotune=autotune, quantized=quantized)
+# first runs of the session are slow (memory allocation), not on the first frame
+model.warmup()
+if keyframe_interval > 1:
+    model = KeyframeDetector(model, keyframe_interval)
 print("Yolo model initialised!")
 
 homography = Homography(distance_grid=200)
@@ -64,8 +77,9 @@ if showprocess & cameraview:
 if __name__ == '__main__':
     frame = camera.get_frame()
     mask = homography.calculateMask(frame)
-    plt.imshow(frame)
-    plt.show()
+    if showmaskframe:
+        plt.imshow(frame)
+        plt.show()
     # image_test = cv2.imread("../20230716-1-small.jpg")
     # mask = homography.calculateMask(image_test)
 
@@ -2,6 +2,8 @@
 # import matplotlib.pyplot as plt
 import numpy as np
 import time
+import sys
+import os
 from math import degrees, atan
 
 from classes.camera import Camera
@@ -10,7 +12,44 @@ from classes.camera import Camera
 # from classes.delaunay import Delaunay
 from classes.robot import Robot, Bicycle_model
 
-from classes.socket import Client
+from classes.socket import Client, SharedMemoryClient
+from classes.adaptive_quality import AdaptiveQuality
+from classes.pipeline import Pipeline
+
+# start of the script, for the time until the car can drive
+t_boot = time.perf_counter()
+
+# capture/encode, send/receive and control run as parallel stages
+pipelined = False
+# send the MJPEG frames of the camera without decoding and encoding them again
+mjpeg_passthrough = False
+# server runs on the same computer (bench runs, simulation): raw frames through shared memory
+shared_memory_transport = False
+# lower JPEG quality and resolution when the wifi link gets slow
+adaptive_quality = False
+target_latency = 0.1 # seconds, send frame -> receive path
+# drive on with the HSV cone detector and path-planning on the pi when the link to the computer drops
+local_fallback = False
+link_timeout = 1.0 # seconds without a path before the link counts as dropped
+# seconds to keep trying to connect, the computer can still be loading the model
+connect_timeout = 30
+# only send crops around the HSV cone proposals, YOLO on the computer classifies them
+# (set split_computing on the computer as well, not with mjpeg_passthrough or shared_memory_transport)
+split_computing = False
+
+# the crops are cut from a decoded frame and sent over the socket
+if split_computing:
+    conflicts = [name for name, enabled in [("mjpeg_passthrough", mjpeg_passthrough),
+                                            ("shared_memory_transport", shared_memory_transport)] if enabled]
+    if len(conflicts) > 0:
+        raise ValueError(f"split_computing can not be used with {', '.join(conflicts)}")
+
+if local_fallback or split_computing:
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "image_processing"))
+    from edge_detection import HsvConeDetector
+if local_fallback:
+    from classes.homography import Homography
+    from classes.delaunay import Delaunay
 
 '''functions'''
 def slope(line):
@@ -24,11 +63,98 @@ def calc_angle(line0, line1):
         return np.round(-1*(atan(temp)*180)/3.1415, 0)
     return np.round((atan(temp)*180)/3.1415, 0)
 
+# steering angle of the last path, kept while braking
+angle = 0
+
+def apply_path(path):
+    global angle
+    speed = 0
+    # the bicycle model steers towards the third point
+    if len(path) >= 3:
+        '''
+        speed = max_speed
+        angle = calc_angle([[0, 0], [0.001, 1]], path[:2])
+        '''
+        speed, angle = bicycle_model.calc_steering_angle(path[2])
+        print(angle)
+    else:
+        print(f"time ran: {(time.perf_counter()-t_start)*1000:.2f} ms")
+    robot.set_speed_and_steeringangle(speed, int(angle))
+
+def get_frame_data(wait_for_new=False):
+    # returns (frame data, scale), the scale is sent along with the frame
+    if mjpeg_passthrough:
+        return camera.get_jpeg(wait_for_new), 1.0
+    scale = client_socket.get_scale()
+    frame = camera.get_frame(wait_for_new, scale)
+    return client_socket.encode_frame_data(frame), scale
+
+def get_crops_data(wait_for_new=False):
+    # full size frame, the crops are sent at their own resolution
+    frame = camera.get_frame(wait_for_new)
+    return client_socket.encode_crops_data(frame, proposal_detector.propose(frame))
+
+'''pipeline stages'''
+# the next frame is captured and encoded while the previous one is still on its way
+# to the computer, the serial communication with the arduino does not stall capturing
+def capture_stage():
+    # the camera grabs in the background, wait for a frame that was not sent yet
+    if split_computing:
+        return get_crops_data(wait_for_new=True), 1.0
+    return get_frame_data(wait_for_new=True)
+
+def send_stage(message):
+    frame_data, scale = message
+    if split_computing:
+        return client_socket.send_crops_data_recv_path(frame_data)
+    return client_socket.send_frame_data_recv_path(frame_data, mjpeg_passthrough, scale)
+
+def control_stage(path):
+    print(np.shape(path))
+    apply_path(path)
+    return None
+
+def run_pipelined():
+    pipeline = Pipeline(queue_size=1)
+    pipeline.add_stage("Capture", capture_stage)
+    pipeline.add_stage("Send", send_stage)
+    pipeline.add_stage("Control", control_stage)
+    pipeline.start()
+    while pipeline.is_running():
+        time.sleep(1)
+        for name, average_time, counter, dropped in pipeline.get_timings():
+            print(f"{name}\t{average_time*1000:.2f} ms\t{counter}\t{dropped}")
+    try:
+        pipeline.join(timeout=1)
+    except OSError as error:
+        if not local_fallback:
+            raise
+        print(f"Link to the computer dropped ({error})")
+        run_local()
+
+'''local fallback'''
+def run_local():
+    # no computer any more, detect the cones and plan the path on the pi itself
+    print("Driving on the HSV cone detector")
+    while True:
+        t0 = time.perf_counter()
+        frame = camera.get_frame(wait_for_new=True)
+        boxes, scores, class_ids = fallback_detector.feed_forward(frame)
+        centerpoints = fallback_detector.xyxyBoxes_to_bottom_centerpoints(boxes)
+        if local_mask is None or len(centerpoints) < 4:
+            path = [[0, 0]] # brake
+        else:
+            world_coordinates = local_homography.perspectiveTransform(centerpoints)
+            delaunay.delaunay(world_coordinates, class_ids)
+            path = delaunay.getPath()
+        apply_path(path)
+        print(f"Local frame: {(time.perf_counter() - t0)*1000:.2f} ms\t{len(centerpoints)} cones")
+
 '''initialisation'''
 fps = 10
 max_speed = 15
 
-camera = Camera(fps)
+camera = Camera(fps, mjpeg_passthrough=mjpeg_passthrough)
 print("Camera initialised!")
 
 robot = Robot('/dev/ttyUSB0')
@@ -38,41 +164,68 @@ bicycle_model = Bicycle_model(max_speed=max_speed)
 print("Bicycle model initialised")
 
 print("Making connection ...")
-client_socket = Client("192.168.1.21")
+if shared_memory_transport:
+    client_socket = SharedMemoryClient("localhost")
+else:
+    quality_controller = AdaptiveQuality(target_latency) if adaptive_quality else None
+    client_socket = Client("192.168.1.21", quality_controller=quality_controller, connect_timeout=connect_timeout)
 print("Connection established")
 
+if local_fallback:
+    fallback_detector = HsvConeDetector()
+    local_homography = Homography(distance_grid=150, square_in_grid=[15, 15])
+    delaunay = Delaunay()
+if split_computing:
+    proposal_detector = HsvConeDetector()
+
 '''running loop'''
 if __name__ == '__main__':
+    if local_fallback:
+        # same chessboard frame as the computer gets, the pi keeps its own mask for the fallback
+        local_mask = local_homography.calculateMask(camera.get_frame())
+        if local_mask is None:
+            print("Local homography failed: the fallback can only brake")
+
     # sending first frame for homography mask to be calculated
-    frame = camera.get_frame()
+    frame_data, scale = get_frame_data()
     # send_frame_recv_path instead of send_frame to prevent deadlock
-    client_socket.send_frame_recv_path(frame)
+    client_socket.send_frame_data_recv_path(frame_data, mjpeg_passthrough, scale)
+    if client_socket.ready:
+        print(f"Computer ready, {time.perf_counter() - t_boot:.1f} s after start")
+    if local_fallback:
+        # only now, the first path waits for the homography and the region of interest
+        client_socket.set_timeout(link_timeout)
 
     t_start = time.perf_counter()
-    
+    if pipelined:
+        run_pipelined()
+        exit(0)
+
     while True:
         # duration processing 1 frame
         t0 = time.perf_counter()
 
-        frame = camera.get_frame()
+        if split_computing:
+            frame_data, scale = get_crops_data(), 1.0
+        else:
+            frame_data, scale = get_frame_data()
         t1 = time.perf_counter()
 
         # sending frame and getting path
-        path = client_socket.send_frame_recv_path(frame)
+        try:
+            if split_computing:
+                path = client_socket.send_crops_data_recv_path(frame_data)
+            else:
+                path = client_socket.send_frame_data_recv_path(frame_data, mjpeg_passthrough, scale)
+        except OSError as error:
+            # socket.timeout and ConnectionError
+            if not local_fallback:
+                raise
+            print(f"Link to the computer dropped ({error})")
+            run_local()
         t2 = time.perf_counter()
 
         print(np.shape(path))
 
         # control
-        speed = 0
-        brake = 0
-        if len(path) >= 2:
-            '''
-            speed = max_speed
-            angle = calc_angle([[0, 0], [0.001, 1]], path[:2])
-            '''
-            speed, angle = bicycle_model.calc_steering_angle(path[2])
-            print(angle)
-        else:
-            print(f"time ran: {(time.perf_counter()-t_start)*1000:.2f} ms")
-        robot.set_speed_and_steeringangle(speed, int(angle))
\ No newline at end of file
+        apply_path(path)
\ No newline at end of file
@@ -1,17 +1,55 @@
 import cv2
 import numpy as np
-import matplotlib.pyplot as plt
 import time
+import threading
+import sys
+import os
 
 # from classes.camera import Camera
-from rpi3Bplus.classes.yolo_onnx import Yolo
+from rpi3Bplus.classes.yolo_onnx import Yolo, TiledYolo, CropYolo, MultiResolutionYolo
 from rpi3Bplus.classes.homography import Homography
 from rpi3Bplus.classes.delaunay import Delaunay
+from rpi3Bplus.classes.utils_onnx import draw_detections
+from rpi3Bplus.classes.pipeline import Pipeline
+from rpi3Bplus.classes.tracking import KeyframeDetector
+from rpi3Bplus.classes.fallback import DeadlineDetector
+from rpi3Bplus.classes.frame_gate import FrameGate
 
-from rpi3Bplus.classes.socket import Server
+from rpi3Bplus.classes.socket import Server, SharedMemoryServer, paste_crops
 
 # print timestamps
 timestamps = True
+# time a few onnxruntime session configurations at startup and use the fastest (cached)
+autotune = False
+# run receive, decode, YOLO, path-planning and recording as parallel stages
+pipelined = False
+# client runs on this computer (bench runs, replays): raw frames through shared memory
+shared_memory_transport = False
+# only send and run YOLO on the part of the frame with ground closer than this (mm, None = full frame)
+roi_max_distance = None
+# drop boxes that are too small or too big for a cone at their distance (cone height in mm, None = off)
+cone_height = None
+# run YOLO on overlapping tiles of the full resolution camera frame for far cones
+# (set mjpeg_passthrough = True on the pi, other frames are already 448x448)
+tiled = False
+tile_size = (320, 320) # (height, width)
+tile_overlap = 0.25
+# run YOLO every n frames (or when boxes get lost), optical flow moves the boxes in between (1 = every frame)
+keyframe_interval = 1
+# seconds, frames YOLO does not finish in time get the boxes of the HSV cone detector (None = off)
+yolo_deadline = None
+# the pi only sends crops around its HSV cone proposals, YOLO runs on the crops (set split_computing
+# on the pi as well, tiled, yolo_deadline and keyframe_interval need whole frames)
+split_computing = False
+# frames with a mean gray difference (0 to 255, 32x32) below this to the last frame run reuse its
+# detections and path (None = off, not with split_computing)
+duplicate_threshold = None
+# pick the YOLO input size per frame from the time budget, the number of cones and the speed, needs a
+# model with a dynamic input size or one per size (YOLOv8n_FSOCO_320.onnx, ...), not with tiled or split_computing
+adaptive_resolution = False
+input_sizes = (448, 320, 256)
+yolo_budget = 0.05 # seconds of YOLO per frame
+max_speed = 15 # speed the pi drives at when it gets a path (trackdrive.py)
 # showimages
 recordrun = True
 floorplan = False # TODO
@@ -20,7 +58,32 @@ cameraview = True
 if recordrun and floorplan:
     import matplotlib.pyplot as plt
 
+# CropYolo gets the crops of the pi, the other detector wrappers need whole frames
+if split_computing:
+    conflicts = [name for name, enabled in [("tiled", tiled), ("yolo_deadline", yolo_deadline is not None),
+                                            ("keyframe_interval", keyframe_interval > 1),
+                                            ("adaptive_resolution", adaptive_resolution),
+                                            ("shared_memory_transport", shared_memory_transport)] if enabled]
+    if len(conflicts) > 0:
+        raise ValueError(f"split_computing can not be used with {', '.join(conflicts)}")
+# FrameGate compares decoded frames, split computing only has crops
+if duplicate_threshold is not None and split_computing:
+    raise ValueError("duplicate_threshold can not be used with split_computing")
+# TiledYolo needs the batch interface of a single Yolo
+if adaptive_resolution and tiled:
+    raise ValueError("adaptive_resolution can not be used with tiled")
+
 '''functions'''
+def recording_frame(frame):
+    # the boxes are in pixels of the full 448x448 frame, a frame the client cropped to the
+    # region of interest is pasted back at its place instead of stretched
+    if roi is not None and frame.shape[:2] == (roi[3] - roi[1], roi[2] - roi[0]):
+        x0, y0, x1, y1 = roi
+        full_frame = np.zeros((448, 448, 3), dtype=np.uint8)
+        full_frame[y0:y1, x0:x1] = frame
+        return full_frame
+    return cv2.resize(frame, (448, 448))
+
 def showGroundplan(coordinates, class_ids):
     plt.figure(0)
     plt.plot(0, 0, "*", color="black")
@@ -35,11 +98,132 @@ def showGroundplan(coordinates, class_ids):
     plt.show()
     return
 
+'''pipeline stages'''
+# every stage runs in its own thread, the bounded queues in between only keep the
+# newest frame so the throughput is set by the slowest stage
+latest_path = [[0, 0]]
+path_lock = threading.Lock()
+recorded = 0
+
+def receive_stage():
+    if split_computing:
+        message = server_socket.recv_crops_data()
+    else:
+        message = server_socket.recv_frame_data()
+    # client waits for a path after every frame, reply with the newest path
+    with path_lock:
+        path = latest_path
+    server_socket.send_path(path)
+    return message
+
+def decode_stage(message):
+    if split_computing:
+        return server_socket.decode_crops_data(message)
+    frame_data, passthrough, scale = message
+    return server_socket.decode_frame_data(frame_data, passthrough, scale, full_resolution=tiled)
+
+def inference_stage(frame):
+    if frame_gate is not None and frame_gate.is_duplicate(frame):
+        # latest_path stays, the receive stage keeps sending it
+        return None
+    boxes, scores, class_ids = model.feed_forward(frame)
+    return frame, boxes, scores, class_ids
+
+def planning_stage(detections):
+    global latest_path
+    frame, boxes, scores, class_ids = detections
+    centerpoints = model.xyxyBoxes_to_bottom_centerpoints(boxes)
+    if len(centerpoints) == 0:
+        # BRAKE ------------------------------------ BRAKE
+        print("No more cones detected")
+        with path_lock:
+            latest_path = [[0, 0]]
+        pipeline.stop()
+        return None
+    world_coordinates = homography.perspectiveTransform(centerpoints)
+
+    if (len(world_coordinates) >= 4):
+        delaunay.delaunay(world_coordinates, class_ids)
+        path = delaunay.getPath()
+    else:
+        path = [[0, 0]] # brake
+    with path_lock:
+        latest_path = path
+    if adaptive_resolution:
+        # the pi brakes on paths shorter than 3 points
+        resolution_model.set_speed(max_speed if len(path) >= 3 else 0)
+
+    if recordrun:
+        return frame, boxes, scores, class_ids, world_coordinates
+    return None
+
+def record_stage(detections):
+    global recorded
+    frame, boxes, scores, class_ids, world_coordinates = detections
+    recorded += 1
+    if split_computing:
+        frame = paste_crops(*frame)
+    if floorplan:
+        showGroundplan(world_coordinates, class_ids)
+    if cameraview:
+        # boxes are passed along, model.boxes can already belong to a newer frame
+        combined_img = draw_detections(recording_frame(frame), boxes, scores, class_ids, 4)
+        file.write(combined_img)
+        if recorded == time_to_run*fps:
+            pipeline.stop()
+    return None
+
+def run_pipelined():
+    pipeline.add_stage("Receive", receive_stage)
+    pipeline.add_stage("Decode", decode_stage)
+    pipeline.add_stage("YOLO", inference_stage)
+    pipeline.add_stage("Path-planning", planning_stage)
+    if recordrun:
+        pipeline.add_stage("Record", record_stage)
+
+    t_start = time.perf_counter()
+    pipeline.start()
+    while pipeline.is_running():
+        time.sleep(1)
+        if timestamps:
+            print(f"Stage\tAverage\tFrames\tDropped")
+            for name, average_time, counter, dropped in pipeline.get_timings():
+                print(f"{name}\t{average_time*1000:.2f} ms\t{counter}\t{dropped}")
+            print(f"average fps: {pipeline.stages[3].counter / (time.perf_counter() - t_start)}")
+            if frame_gate is not None:
+                print(f"duplicate frames: {frame_gate.hits}/{frame_gate.frames} ({frame_gate.get_hit_ratio()*100:.1f} %)")
+            if adaptive_resolution:
+                print(f"input size: {resolution_model.governor.size}\tframes per size: {resolution_model.governor.frames_per_size}")
+    # receive stage can be blocked on the socket, do not wait for it forever
+    pipeline.join(timeout=1)
+    if recordrun & cameraview:
+        file.release()
+
 '''initialisation'''
 distance_grid = 150
+roi = None # region of interest, set after the homography
 
 onnx_path = "rpi3Bplus/data/YOLOv8n_FSOCO.onnx"
-model = Yolo(onnx_path)
+if adaptive_resolution:
+    model = MultiResolutionYolo(onnx_path, input_sizes, yolo_budget, autotune=autotune)
+    resolution_model = model
+else:
+    model = Yolo(onnx_path, autotune=autotune)
+# first runs of the session are slow (memory allocation), done before the pi waits for paths
+t0 = time.perf_counter()
+model.warmup()
+print(f"Warm-up: {(time.perf_counter() - t0)*1000:.2f} ms")
+if split_computing:
+    model = CropYolo(model)
+if tiled:
+    # boxes in pixels of the 448x448 frame the homography is calculated on
+    model = TiledYolo(model, tile_size=tile_size, overlap=tile_overlap, output_size=(448, 448))
+if yolo_deadline is not None:
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "image_processing"))
+    from image_processing.edge_detection import HsvConeDetector
+    model = DeadlineDetector(model, HsvConeDetector(output_size=(448, 448) if tiled else None), yolo_deadline)
+if keyframe_interval > 1:
+    model = KeyframeDetector(model, keyframe_interval, output_size=(448, 448) if tiled else None)
 print("Yolo model initialised!")
 
 homography = Homography(distance_grid=distance_grid, square_in_grid=[15, 15])
@@ -48,8 +232,13 @@ print("Homography initialised!")
 delaunay = Delaunay()
 print("Delaunay path-planning initialised")
 
+frame_gate = FrameGate(duplicate_threshold) if duplicate_threshold is not None else None
+
 print("Searching for connection ...")
-server_socket = Server()
+if shared_memory_transport:
+    server_socket = SharedMemoryServer()
+else:
+    server_socket = Server()
 print("Connection established")
 
 if recordrun & cameraview:
@@ -59,6 +248,8 @@ if recordrun & cameraview:
     file = cv2.VideoWriter('trackdrive_videos/cameraview.avi', fourcc, fps, (448, 448))
 if recordrun & floorplan:
     file2 = cv2.VideoWriter('trackdrive_videos/map.avi', fourcc, fps, (448, 448))
+if pipelined:
+    pipeline = Pipeline(queue_size=1)
 
 
 '''running loop'''
@@ -76,40 +267,65 @@ if __name__ == '__main__':
         print("Check if chessboard is {} mm in front of the car".format(distance_grid))
         exit(1)
     
+    if roi_max_distance is not None:
+        roi = homography.calculateRoi(frame.shape[:2], roi_max_distance, cone_height)
+        cone_band = homography.calculateConeBand(frame.shape[:2], cone_height) if cone_height is not None else None
+        model.set_roi(roi, cone_band)
+        # the client crops the frames before encoding them
+        server_socket.send_roi(roi)
+        print(f"Region of interest: {roi}")
+
+    # model is warmed up, the pi can start driving
+    server_socket.send_ready()
     # to prevent deadlock
     server_socket.send_path([[0,0]])
+    if pipelined:
+        run_pipelined()
+        exit(0)
+
     counter = 0
     while True:
         counter += 1
         # duration processing 1 frame
         t0 = time.perf_counter()
 
-        frame = server_socket.recv_frame()
+        if split_computing:
+            frame = server_socket.recv_crops()
+        else:
+            frame = server_socket.recv_frame(full_resolution=tiled)
         t1 = time.perf_counter()
 
-        # running Yolo on the frame
-        boxes, scores, class_ids = model.feed_forward(frame)
-        t2 = time.perf_counter()
-
-        # extracting cones-position pixel-coordinates
-        centerpoints = model.xyxyBoxes_to_bottom_centerpoints(boxes)
-
-        # calculating homography
-        if len(centerpoints) == 0:
-            # BRAKE ------------------------------------ BRAKE
-            print("No more cones detected")
-            exit(0)
-        if mask is not None:
-            world_coordinates = homography.perspectiveTransform(centerpoints)
-        t3 = time.perf_counter()
-
-        # path-planning
-        # output only for debugging as it is saved in the class
-        if (len(world_coordinates) >= 4):
-            yellow_edges, blue_edges, mixed_edges = delaunay.delaunay(world_coordinates, class_ids)
-            path = delaunay.getPath()
+        duplicate = frame_gate is not None and frame_gate.is_duplicate(frame)
+        if duplicate:
+            # nearly the same frame as the last one run: same cones, same path
+            t2 = t3 = time.perf_counter()
         else:
-            path = [[0, 0]] # brake
+            # running Yolo on the frame
+            boxes, scores, class_ids = model.feed_forward(frame)
+            t2 = time.perf_counter()
+
+            # extracting cones-position pixel-coordinates
+            centerpoints = model.xyxyBoxes_to_bottom_centerpoints(boxes)
+
+            # calculating homography
+            if len(centerpoints) == 0:
+                # BRAKE ------------------------------------ BRAKE
+                print("No more cones detected")
+                exit(0)
+            if mask is not None:
+                world_coordinates = homography.perspectiveTransform(centerpoints)
+            t3 = time.perf_counter()
+
+            # path-planning
+            # output only for debugging as it is saved in the class
+            if (len(world_coordinates) >= 4):
+                yellow_edges, blue_edges, mixed_edges = delaunay.delaunay(world_coordinates, class_ids)
+                path = delaunay.getPath()
+            else:
+                path = [[0, 0]] # brake
+            if adaptive_resolution:
+                # the pi brakes on paths shorter than 3 points
+                resolution_model.set_speed(max_speed if len(path) >= 3 else 0)
 
         t4 = time.perf_counter()
 
@@ -123,6 +339,12 @@ if __name__ == '__main__':
             print(f"Frame\tOverall\tReceive\tYOLO\tHomography\tPath-planning\tSend")
             print(f"{counter}\t{(t5 - t0)*1000:.2f} ms\t{(t1 - t0)*1000:.2f} ms\t{(t2 - t1)*1000:.2f} ms\t{(t3 - t2)*1000:.2f} ms\t{(t4 - t3)*1000:.2f} ms\t{(t5 - t4)*1000:.2f} ms")
             print(f"average fps: {counter / (time.perf_counter() - t_start)}")
+            if split_computing:
+                print(f"crops: {len(frame[0])} (average {model.get_average_crops():.1f})")
+            if frame_gate is not None:
+                print(f"duplicate frames: {frame_gate.hits}/{frame_gate.frames} ({frame_gate.get_hit_ratio()*100:.1f} %)")
+            if adaptive_resolution:
+                print(f"input size: {resolution_model.governor.size}\tframes per size: {resolution_model.governor.frames_per_size}")
             # print(f"Processing image {counter}")
             # print(f"Overall time for 1 frame: \t{(t3 - t0)*1000:.2f} ms")
             # print(f"Take image time for 1 frame: \t{(t1 - t0)*1000:.2f} ms")
@@ -134,7 +356,9 @@ if __name__ == '__main__':
             if floorplan:
                 showGroundplan(world_coordinates, class_ids)
             if cameraview:
-                combined_img = model.draw_detections(frame)
+                if split_computing:
+                    frame = paste_crops(*frame)
+                combined_img = model.draw_detections(recording_frame(frame))
                 # cv2.imshow("camera view", combined_img)
                 '''
                 plt.figure(0)
@@ -0,0 +1,92 @@
+import threading
+import time
+
+from rpi3Bplus.classes.yolo_onnx import Yolo
+from rpi3Bplus.classes.homography import Homography
+from rpi3Bplus.classes.delaunay import Delaunay
+from rpi3Bplus.classes.batching import BatchedDetector
+
+from rpi3Bplus.classes.socket import MultiServer
+
+# print timestamps
+timestamps = True
+
+'''functions'''
+def handle_car(connection, car_id):
+    # every car has its own homography mask and path-planning, YOLO is shared
+    homography = Homography(distance_grid=distance_grid, square_in_grid=[15, 15])
+    delaunay = Delaunay()
+
+    try:
+        frame = connection.recv_frame()
+        mask = homography.calculateMask(frame)
+        if mask is None:
+            print(f"Car {car_id}: homography failed: didn't find chessboard")
+            print("Check if chessboard is {} mm in front of the car".format(distance_grid))
+            connection.close()
+            return
+        print(f"Car {car_id}: homography mask calculated!")
+
+        # to prevent deadlock
+        connection.send_path([[0, 0]])
+        counter = 0
+        while True:
+            counter += 1
+            t0 = time.perf_counter()
+
+            frame = connection.recv_frame()
+            t1 = time.perf_counter()
+
+            # running Yolo on the frame, batched with the frames of the other cars
+            boxes, scores, class_ids = detector.detect(frame)
+            t2 = time.perf_counter()
+
+            # extracting cones-position pixel-coordinates
+            centerpoints = model.xyxyBoxes_to_bottom_centerpoints(boxes)
+            if len(centerpoints) == 0:
+                # BRAKE ------------------------------------ BRAKE
+                print(f"Car {car_id}: no more cones detected")
+                connection.send_path([[0, 0]])
+                break
+            world_coordinates = homography.perspectiveTransform(centerpoints)
+
+            # path-planning
+            if (len(world_coordinates) >= 4):
+                delaunay.delaunay(world_coordinates, class_ids)
+                path = delaunay.getPath()
+            else:
+                path = [[0, 0]] # brake
+            connection.send_path(path)
+            t3 = time.perf_counter()
+
+            if timestamps:
+                print(f"Car {car_id}\tframe {counter}\tReceive {(t1 - t0)*1000:.2f} ms\tYOLO {(t2 - t1)*1000:.2f} ms\t" +
+                      f"Overall {(t3 - t0)*1000:.2f} ms\taverage batch {detector.get_average_batch_size():.2f}")
+    except ConnectionError:
+        print(f"Car {car_id}: connection lost")
+    connection.close()
+
+'''initialisation'''
+distance_grid = 150
+
+onnx_path = "rpi3Bplus/data/YOLOv8n_FSOCO.onnx"
+model = Yolo(onnx_path)
+print("Yolo model initialised!")
+
+# wait at most 10 ms for frames of other cars before running a batch
+detector = BatchedDetector(model, max_batch_size=8, max_delay=0.01)
+detector.start()
+if not model.dynamic_batch:
+    print("Model has a fixed batch size of 1, frames of different cars are run one by one")
+
+server_socket = MultiServer()
+
+'''running loop'''
+if __name__ == '__main__':
+    car_id = 0
+    while True:
+        print("Searching for connection ...")
+        connection = server_socket.accept()
+        car_id += 1
+        print(f"Connection established with car {car_id} ({connection.addr[0]})")
+        threading.Thread(target=handle_car, args=(connection, car_id), daemon=True).start()
@@ -61,6 +61,52 @@ def nms(boxes, scores, iou_threshold):
     
     return keep_boxes
 
+def compute_iou_matrix(boxes):
+    # IoU of every box with every other box, (n, n) in one go
+    xmin = np.maximum(boxes[:, np.newaxis, 0], boxes[np.newaxis, :, 0])
+    ymin = np.maximum(boxes[:, np.newaxis, 1], boxes[np.newaxis, :, 1])
+    xmax = np.minimum(boxes[:, np.newaxis, 2], boxes[np.newaxis, :, 2])
+    ymax = np.minimum(boxes[:, np.newaxis, 3], boxes[np.newaxis, :, 3])
+    intersection_area = np.maximum(0, xmax - xmin) * np.maximum(0, ymax - ymin)
+
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    union_area = areas[:, np.newaxis] + areas[np.newaxis, :] - intersection_area
+    return intersection_area / np.maximum(union_area, 1e-9)
+
+def multiclass_nms(boxes, scores, class_ids, iou_threshold, max_detections=None):
+    # class aware non-maxima suppression: only boxes of the same class suppress each other,
+    # so a yellow cone overlapping a blue cone keeps both. Returns indices, highest score first
+    if len(scores) == 0:
+        return np.zeros(0, dtype=int)
+    if hasattr(cv2.dnn, "NMSBoxesBatched"):
+        # opencv >= 4.7, runs in C++
+        xywh_boxes = np.copy(boxes)
+        xywh_boxes[:, 2:] -= boxes[:, :2]
+        indices = cv2.dnn.NMSBoxesBatched(xywh_boxes.tolist(), scores.tolist(), np.asarray(class_ids).tolist(),
+                                          0.0, iou_threshold)
+        indices = np.asarray(indices, dtype=int).reshape(-1)
+        # sort on score, opencv does not guarantee the order over classes
+        indices = indices[np.argsort(scores[indices])[::-1]]
+        return indices if max_detections is None else indices[:max_detections]
+
+    order = np.argsort(scores)[::-1]
+    class_ids = np.asarray(class_ids)[order]
+    # only boxes with a higher score (earlier in order) can suppress a box
+    overlapping = compute_iou_matrix(boxes[order]) > iou_threshold
+    overlapping &= class_ids[:, np.newaxis] == class_ids[np.newaxis, :]
+    overlapping = np.triu(overlapping, k=1)
+
+    suppressed = np.zeros(len(order), dtype=bool)
+    keep = []
+    for index in range(len(order)):
+        if suppressed[index]:
+            continue
+        keep.append(index)
+        if max_detections is not None and len(keep) == max_detections:
+            break
+        suppressed |= overlapping[index]
+    return order[keep]
+
 def draw_detections(image, boxes, scores, class_ids, mask_alpha=0.3):
     mask_img = image.copy()
     det_img = image.copy()
@@ -1,19 +1,39 @@
 import numpy as np
 import cv2
 
-import onnxruntime
-
-from yolo.utils_onnx import xywh2xyxy, nms, draw_detections, get_class_name, get_color
+from yolo.utils_onnx import xywh2xyxy, multiclass_nms, draw_detections, get_class_name, get_color
+# session configuration and autotune of the detector on the car
+from rpi3Bplus.classes.yolo_onnx import get_session_config, create_session, autotune_session, autotune_image_path
 
 class Yolo:
-    def __init__(self, path_of_model, conf_thres=0.5, iou_thres=0.5):
+    def __init__(self, path_of_model, conf_thres=0.5, iou_thres=0.5, max_detections=100, session_config=None, autotune=False, autotune_frame=None):
         # thresholds
         self.conf_threshold = conf_thres
         self.iou_threshold = iou_thres
+        self.max_detections = max_detections # top-k after nms
         # onnx model
-        self.session = onnxruntime.InferenceSession(path_of_model)
+        self.session_config = get_session_config(session_config)
+        self.session = create_session(path_of_model, self.session_config)
         self.get_input_details()
         self.get_output_details()
+        # preprocessing buffers, allocated once and reused for every frame
+        self.resized_frame = np.empty((self.input_height, self.input_width, 3), dtype=np.uint8)
+        self.input_tensor = np.empty((1, 3, self.input_height, self.input_width), dtype=np.float32)
+
+        if autotune:
+            self.autotune(path_of_model, autotune_frame)
+
+    def autotune(self, path_of_model, frame=None):
+        # picks the fastest session configuration for this machine and model (cached)
+        if frame is None:
+            frame = cv2.imread(autotune_image_path)
+        if frame is None:
+            # test images not found, the network takes as long on noise
+            frame = np.random.randint(0, 256, (self.input_height, self.input_width, 3), dtype=np.uint8)
+        inputs = {self.input_names[0]: self.preprocess_input(frame).copy()}
+        self.session_config = autotune_session(path_of_model, inputs)
+        self.session = create_session(path_of_model, self.session_config)
+        print(f"Session config: {self.session_config}")
 
     def get_input_details(self):
         model_inputs = self.session.get_inputs()
@@ -21,22 +41,33 @@ class Yolo:
         self.input_shape = model_inputs[0].shape
         self.input_height = self.input_shape[2]
         self.input_width = self.input_shape[3]
+        # batch axis is a name (e.g. "batch") for models exported with a dynamic batch size
+        self.dynamic_batch = not isinstance(self.input_shape[0], int) or self.input_shape[0] != 1
     
     def get_output_details(self):
         model_outputs = self.session.get_outputs()
         self.output_names = [model_outputs[i].name for i in range(len(model_outputs))]
 
+    def prepare_frame(self, frame, resized_frame, input_tensor):
+        # resize first, the color conversion then only touches the smaller image
+        cv2.resize(frame, (self.input_width, self.input_height), dst=resized_frame)
+        # BGR to RGB, HWC to CHW and scaling to 0 to 1 in one pass per channel,
+        # written straight into the float32 input tensor
+        for channel in range(3):
+            np.multiply(resized_frame[:, :, 2 - channel], 1 / 255.0,
+                        out=input_tensor[channel], dtype=np.float32)
+
     def preprocess_input(self, frame):
         self.img_height, self.img_width = frame.shape[:2]
-        
-        input_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        self.prepare_frame(frame, self.resized_frame, self.input_tensor[0])
+        return self.input_tensor
 
-        input_frame = cv2.resize(input_frame, (self.input_width, self.input_height))
-        # Scale input pixel values to 0 to 1
-        input_frame = input_frame / 255.0
-        input_frame = input_frame.transpose(2, 0, 1)
-        input_tensor = input_frame[np.newaxis, :, :, :].astype(np.float32)
-        
+    def preprocess_batch(self, frames):
+        # own buffers, the ones of preprocess_input can be in use by feed_forward
+        resized_frame = np.empty_like(self.resized_frame)
+        input_tensor = np.empty((len(frames), 3, self.input_height, self.input_width), dtype=np.float32)
+        for index, frame in enumerate(frames):
+            self.prepare_frame(frame, resized_frame, input_tensor[index])
         return input_tensor
     
     def rescale_boxes(self, boxes):
@@ -55,26 +86,57 @@ class Yolo:
         return boxes
     
     def process_output(self, outputs):
-        predictions = np.squeeze(outputs[0]).T
+        # (4 + classes, anchors), thresholded in this layout so only the
+        # predictions above the threshold are copied
+        output = outputs[0][0]
         
 		# Filter out object confidence scores below threshold
-        scores = np.max(predictions[:, 4:], axis=1)
-        predictions = predictions[scores > self.conf_threshold, :]
-        scores = scores[scores > self.conf_threshold]
+        scores = np.max(output[4:], axis=0)
+        keep = np.nonzero(scores > self.conf_threshold)[0]
         
-        if len(scores) == 0:
+        if len(keep) == 0:
             return [], [], []
+        scores = scores[keep]
         
 		# Get the class with the highest confidence
-        class_ids = np.argmax(predictions[:, 4:], axis=1)
+        class_ids = np.argmax(output[4:, keep], axis=0)
         
 		# Get bounding boxes for each object
-        boxes = self.extract_boxes(predictions)
+        boxes = self.extract_boxes(output[:4, keep].T)
         
-		# Apply non-maxima suppression to suppress weak, overlapping bounding boxes
-        indices = nms(boxes, scores, self.iou_threshold)
+		# Apply class aware non-maxima suppression to suppress weak, overlapping bounding boxes
+        indices = multiclass_nms(boxes, scores, class_ids, self.iou_threshold, self.max_detections)
         return boxes[indices], scores[indices], class_ids[indices]
     
+    def process_output_batch(self, output, image_sizes):
+        # output (batch, 4 + classes, anchors), thresholded for all frames at once
+        # without transposing the whole output
+        scores = np.max(output[:, 4:, :], axis=1)
+        frame_indices, anchor_indices = np.nonzero(scores > self.conf_threshold)
+        results = [([], [], []) for i in range(len(image_sizes))]
+        if len(frame_indices) == 0:
+            return results
+
+        scores = scores[frame_indices, anchor_indices]
+        # (detections, classes) and (detections, 4)
+        class_ids = np.argmax(output[frame_indices, 4:, anchor_indices], axis=1)
+        boxes = output[frame_indices, :4, anchor_indices]
+
+        # rescale every box to the size of its own frame, then to xyxy
+        image_sizes = np.array(image_sizes, dtype=np.float32) # (height, width) per frame
+        scale = image_sizes[frame_indices][:, ::-1] / np.array([self.input_width, self.input_height], dtype=np.float32)
+        boxes = xywh2xyxy(boxes * np.tile(scale, 2))
+
+        # one class aware nms for the whole batch, every (frame, class) is its own group
+        groups = frame_indices * (output.shape[1] - 4) + class_ids
+        indices = multiclass_nms(boxes, scores, groups, self.iou_threshold)
+
+        for frame_index in range(len(image_sizes)):
+            keep = indices[frame_indices[indices] == frame_index][:self.max_detections]
+            if len(keep) > 0:
+                results[frame_index] = (boxes[keep], scores[keep], class_ids[keep])
+        return results
+
     def feed_forward(self, frame):
         input_tensor = self.preprocess_input(frame)
         
@@ -84,6 +146,22 @@ class Yolo:
         self.boxes, self.scores, self.class_ids = self.process_output(outputs)
         
         return self.boxes, self.scores, self.class_ids
+
+    def feed_forward_batch(self, frames):
+        # returns [(boxes, scores, class_ids), ...] with one entry per frame,
+        # nothing is kept on the instance so it can be called from several threads
+        if len(frames) == 0:
+            return []
+        input_tensor = self.preprocess_batch(frames)
+
+        if self.dynamic_batch:
+            output = self.session.run(self.output_names, {self.input_names[0]: input_tensor})[0]
+        else:
+            # model exported with a batch size of 1, only the post-processing is batched
+            output = np.concatenate([self.session.run(self.output_names, {self.input_names[0]: input_tensor[index:index+1]})[0]
+                                     for index in range(len(frames))])
+
+        return self.process_output_batch(output, [frame.shape[:2] for frame in frames])
     
     def draw_detections(self, image, mask_alpha=4):
         return draw_detections(image, self.boxes, self.scores, self.class_ids, mask_alpha)
@@ -0,0 +1,23 @@
+'''imports'''
+import glob
+
+'''personal imports'''
+from rpi3Bplus.classes.yolo_onnx import create_detector, compare_detectors
+from image_processing.image import readImage
+
+onnx_path = "rpi3Bplus/data/YOLOv8n_FSOCO.onnx"
+pt_path = "yolo/YOLOv8n_FSOCO.pt"
+paths = sorted(glob.glob("testimages/*-small.jpg"))
+
+images = [readImage(path) for path in paths]
+
+# the first backend is the reference for the agreement
+detectors = {"onnxruntime": create_detector("onnxruntime", onnx_path)}
+for backend, path in [("opencv", onnx_path), ("ultralytics", pt_path)]:
+    try:
+        detectors[backend] = create_detector(backend, path)
+    except Exception as error:
+        print(f"Backend {backend} not available: {error}")
+
+print(f"{len(images)} images, backends: {list(detectors)}")
+compare_detectors(detectors, images)
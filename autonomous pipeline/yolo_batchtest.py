@@ -0,0 +1,26 @@
+'''imports'''
+import glob
+import time
+
+'''personal imports'''
+from yolo.yolo_onnx import Yolo
+from image_processing.image import readImage
+
+paths = sorted(glob.glob("testimages/*-small.jpg"))
+
+images = [readImage(path) for path in paths]
+model = Yolo("yolo/YOLOv8n_FSOCO.onnx")
+print(f"{len(images)} images, dynamic batch axis: {model.dynamic_batch}")
+
+# one image per session call
+start_time = time.perf_counter()
+single_results = [model.feed_forward(image) for image in images]
+print(f"One by one: {(time.perf_counter() - start_time)*1000:.2f} ms")
+
+# all images in one batch
+start_time = time.perf_counter()
+batch_results = model.feed_forward_batch(images)
+print(f"Batch: {(time.perf_counter() - start_time)*1000:.2f} ms")
+
+for path, (boxes, scores, class_ids), (batch_boxes, batch_scores, batch_class_ids) in zip(paths, single_results, batch_results):
+    print(f"{path}: {len(boxes)} cones one by one, {len(batch_boxes)} cones in batch")